@@ -12,10 +12,9 @@ def res(name):
 
 class MainWindow(QtWidgets.QDialog):
     signal_queue_size = QtCore.pyqtSignal(int, name="queue_size")
+    signal_pending_bytes = QtCore.pyqtSignal(object, object, name="pending_bytes")
     signal_id_update = QtCore.pyqtSignal(name="id_update")
     signal_status_update = QtCore.pyqtSignal(name="status_update")
-    signal_color_image = QtCore.pyqtSignal(object, name="color_image")
-    signal_event_snapshot = QtCore.pyqtSignal(object, name="event_snapshot")
 
     def __init__(self, args, controller, parent=None):
         super(MainWindow, self).__init__(parent)
@@ -30,21 +29,56 @@ class MainWindow(QtWidgets.QDialog):
 
         self.sig_queue_size = QtCore.pyqtSignal(int)
         self.signal_queue_size.connect(self.display_log)
+        self.signal_pending_bytes.connect(self.display_pending)
 
         self.signal_id_update.connect(self.update_ids)
-        self.signal_color_image.connect(self.display_realsense)
-        self.signal_event_snapshot.connect(self.display_eventstream)
         self.signal_status_update.connect(self.update_status)
 
-    def display_realsense(self, color_frame):
-        self.rs_color_frame.setPixmap(QtGui.QPixmap.fromImage(color_frame))
-
-    def display_eventstream(self, event_frame):
-        self.event_frame.setPixmap(QtGui.QPixmap.fromImage(event_frame))
+        # the readers render previews into mailboxes, the window takes the newest at the preview rate
+        self.previews = []
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_timer.timeout.connect(self.update_previews)
+        self.preview_timer.start(int(1000 / max(self.args.preview_fps, 1)))
+
+        if self.args.master:
+            self.station_timer = QtCore.QTimer(self)
+            self.station_timer.timeout.connect(self.update_stations)
+            self.station_timer.start(1000)
+
+    def register_preview(self, name, preview):
+        label = {"realsense": self.rs_color_frame, "event": self.event_frame}[name]
+        self.previews.append((preview, label))
+
+    def update_previews(self):
+        for preview, label in self.previews:
+            frame = preview.take()
+            if frame is None:
+                continue
+            image_format = QtGui.QImage.Format_BGR888 if frame.ndim == 3 else QtGui.QImage.Format_Grayscale8
+            image = QtGui.QImage(frame.data, frame.shape[1], frame.shape[0], frame.strides[0], image_format)
+            # fromImage copies the pixels, the preview may reuse the buffer after the next take
+            label.setPixmap(QtGui.QPixmap.fromImage(image))
 
     def display_log(self, size):
         self.queue_state.setText("Write Queue Size = {}".format(size))
 
+    def display_pending(self, pending, spilled):
+        self.pending_state.setText("Pending = {:.0f} MB ({:.0f} MB spilled)".format(pending / 2 ** 20, spilled / 2 ** 20))
+
+    def update_stations(self):
+        rows = ["{:<21} {:>5} {:>7} {:>6} {:>6} {:>5} {:>5} {:>8} {:>6}".format(
+            "station", "queue", "pending", "MB/s", "freeGB", "drop", "fps", "offsetms", "rttms")]
+        for name, status in sorted(self.controller.station_table().items()):
+            problems = self.controller.station_problems(status)
+            # a client without a clock measurement yet shows "-"
+            clock = ["{:>8.3f}".format(status["offset"] * 1000) if "offset" in status else "{:>8}".format("-"),
+                     "{:>6.3f}".format(status["rtt"] * 1000) if "rtt" in status else "{:>6}".format("-")]
+            rows.append("{:<21} {:>5} {:>7.0f} {:>6.1f} {:>6.0f} {:>5} {:>5.1f} {} {}{}".format(
+                name, status.get("queue_depth", 0), status.get("pending_bytes", 0) / 2 ** 20,
+                status.get("write_bps", 0) / 2 ** 20, status.get("free_disk", 0) / 2 ** 30,
+                status.get("dropped_frames", 0), status.get("capture_fps", 0), *clock, " !" if problems else ""))
+        self.station_state.setText("\n".join(rows))
+
     def initUI(self, margin=30):
         self.rs_color_frame = QtWidgets.QLabel(self)
 
@@ -63,7 +97,7 @@ class MainWindow(QtWidgets.QDialog):
             right_column_x = 480 + margin
         else:
             self.width = 1020
-            self.height = 480
+            self.height = 600
             self.rs_color_frame.setGeometry(0, 0, 270, 480)
             self.event_frame.setGeometry(320, 0, 300, 480)
             self.setFixedSize(self.width, self.height)
@@ -90,6 +124,21 @@ class MainWindow(QtWidgets.QDialog):
         self.person_state.setText("Current Person = 0")
         self.person_state.setFont(font)
 
+        self.pending_state = QtWidgets.QLabel(self)
+        self.pending_state.setGeometry(right_column_x, 180, 350, 30)
+        self.pending_state.setText("Pending = 0 MB (0 MB spilled)")
+        self.pending_state.setFont(font)
+
+        self.station_state = QtWidgets.QLabel(self)
+        self.station_state.setGeometry(right_column_x, 215, self.width - right_column_x, 120)
+        self.station_state.setAlignment(QtCore.Qt.AlignTop | QtCore.Qt.AlignLeft)
+        station_font = QtGui.QFont("Monospace")
+        station_font.setStyleHint(QtGui.QFont.TypeWriter)
+        station_font.setPointSize(8)
+        self.station_state.setFont(station_font)
+        if not self.args.master:
+            self.station_state.hide()
+
         row_height = 80
         button_group_y = self.height - (3 * row_height) - 20
         button_width = (self.width - right_column_x - 2 * margin) // 2
@@ -198,7 +247,10 @@ class MainWindow(QtWidgets.QDialog):
             self.btn_record.setText("Record")
         else:
             print("=" * 20, "record button clicked")
-            self.controller.set_record()
+            if not self.controller.set_record():
+                self.update_stations()
+                self.status.setText("Busy")
+                return
             self.status.setText("Recording")
             self.btn_record.setText("Save")
 
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+
+from reader.depth_writers import detect_depth_format, load_depth_frames, open_depth_writer
+
+CALIBRATION_NAME = "calibration.json"
+
+
+def parse_args():
+    par = argparse.ArgumentParser("align depth recorded with --raw-capture to the color stream")
+    par.add_argument("--path", default="./dataset", help="the dataset folder to process")
+    par.add_argument("-j", "--jobs", default=max(1, os.cpu_count() // 2), type=int,
+                     help="number of takes aligned in parallel.")
+    return par.parse_args()
+
+
+def pixel_rays(intrinsics, xs, ys):
+    # inverse of project_points for a given pixel grid, following rs2_deproject_pixel_to_point
+    x = (xs - intrinsics["ppx"]) / intrinsics["fx"]
+    y = (ys - intrinsics["ppy"]) / intrinsics["fy"]
+    c = intrinsics["coeffs"]
+    model = intrinsics["model"]
+    if model == "inverse_brown_conrady":
+        r2 = x * x + y * y
+        f = 1 + c[0] * r2 + c[1] * r2 * r2 + c[4] * r2 * r2 * r2
+        x, y = x * f + 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x), y * f + 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+    elif model == "brown_conrady":
+        x0, y0 = x, y
+        for _ in range(10):
+            r2 = x * x + y * y
+            icdist = 1 / (1 + ((c[4] * r2 + c[1]) * r2 + c[0]) * r2)
+            dx = 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x)
+            dy = 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+            x, y = (x0 - dx) * icdist, (y0 - dy) * icdist
+    elif model != "none":
+        raise ValueError("unsupported distortion model {}".format(model))
+    return x, y
+
+
+def project_points(intrinsics, points):
+    # points is (..., 3), returns pixel coordinates following rs2_project_point_to_pixel
+    x = points[..., 0] / points[..., 2]
+    y = points[..., 1] / points[..., 2]
+    c = intrinsics["coeffs"]
+    model = intrinsics["model"]
+    if model in ("modified_brown_conrady", "brown_conrady"):
+        r2 = x * x + y * y
+        f = 1 + c[0] * r2 + c[1] * r2 * r2 + c[4] * r2 * r2 * r2
+        if model == "modified_brown_conrady":
+            x, y = x * f, y * f
+            x, y = x + 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x), y + 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+        else:
+            x, y = x * f + 2 * c[2] * x * y + c[3] * (r2 + 2 * x * x), y * f + 2 * c[3] * x * y + c[2] * (r2 + 2 * y * y)
+    elif model not in ("none", "inverse_brown_conrady"):
+        raise ValueError("unsupported distortion model {}".format(model))
+    return x * intrinsics["fx"] + intrinsics["ppx"], y * intrinsics["fy"] + intrinsics["ppy"]
+
+
+class DepthAligner:
+    # vectorized equivalent of rs.align(rs.stream.color) for z16 depth: every depth pixel is spread over the
+    # color pixels covered by its projected corners, overlapping pixels keep the nearest depth.
+
+    def __init__(self, calibration):
+        self.depth_intrinsics = calibration["depth_intrinsics"]
+        self.color_intrinsics = calibration["color_intrinsics"]
+        self.rotation = np.asarray(calibration["extrinsics"]["rotation"], dtype=np.float64).reshape(3, 3).T
+        self.translation = np.asarray(calibration["extrinsics"]["translation"], dtype=np.float64)
+        self.depth_scale = calibration["depth_scale"]
+
+        height, width = self.depth_intrinsics["height"], self.depth_intrinsics["width"]
+        ys, xs = np.mgrid[0:height, 0:width].astype(np.float64)
+        self.corner_rays = [pixel_rays(self.depth_intrinsics, xs + offset, ys + offset) for offset in (-0.5, 0.5)]
+        self.out_shape = (self.color_intrinsics["height"], self.color_intrinsics["width"])
+
+    def project_corner(self, rays, z):
+        points = np.stack([rays[0] * z, rays[1] * z, z], axis=-1) @ self.rotation.T + self.translation
+        return project_points(self.color_intrinsics, points)
+
+    def align(self, depth):
+        valid = depth > 0
+        raw = depth[valid]
+        z = raw.astype(np.float64) * self.depth_scale
+        x0, y0 = self.project_corner((self.corner_rays[0][0][valid], self.corner_rays[0][1][valid]), z)
+        x1, y1 = self.project_corner((self.corner_rays[1][0][valid], self.corner_rays[1][1][valid]), z)
+        # truncation towards zero, same as the static_cast<int> in librealsense
+        x0, y0 = (x0 + 0.5).astype(np.int64), (y0 + 0.5).astype(np.int64)
+        x1, y1 = (x1 + 0.5).astype(np.int64), (y1 + 0.5).astype(np.int64)
+
+        height, width = self.out_shape
+        inside = (x0 >= 0) & (y0 >= 0) & (x1 < width) & (y1 < height)
+        x0, y0, x1, y1, raw = x0[inside], y0[inside], x1[inside], y1[inside], raw[inside]
+
+        # empty pixels are max so np.minimum.at keeps the nearest depth, they are set back to 0 at the end
+        out = np.full(height * width, np.iinfo(np.uint16).max, dtype=np.uint16)
+        max_w = int((x1 - x0).max(initial=0)) + 1
+        max_h = int((y1 - y0).max(initial=0)) + 1
+        for dy in range(max_h):
+            for dx in range(max_w):
+                cover = (x0 + dx <= x1) & (y0 + dy <= y1)
+                np.minimum.at(out, (y0[cover] + dy) * width + x0[cover] + dx, raw[cover])
+        out[out == np.iinfo(np.uint16).max] = 0
+        return out.reshape(height, width)
+
+
+def find_unaligned(path):
+    for root, dirs, files in os.walk(path):
+        # staged recordings and takes still being written
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        if os.path.basename(root) != "depth_raw" or CALIBRATION_NAME not in files:
+            continue
+        with open(os.path.join(root, CALIBRATION_NAME)) as f:
+            if not json.load(f).get("aligned", False):
+                yield root
+
+
+def align_take(modal_path):
+    start_time = time.time()
+    with open(os.path.join(modal_path, CALIBRATION_NAME)) as f:
+        calibration = json.load(f)
+    aligner = DepthAligner(calibration)
+    frames, timestamps = load_depth_frames(modal_path)
+
+    aligned_path = modal_path + ".aligning"
+    shutil.rmtree(aligned_path, ignore_errors=True)
+    os.makedirs(aligned_path)
+    depth_writer = open_depth_writer(detect_depth_format(modal_path), aligned_path)
+    for i in range(len(frames)):
+        depth_writer.append(aligner.align(frames[i]), timestamps[i])
+    depth_writer.close()
+    del frames
+
+    calibration["aligned"] = True
+    with open(os.path.join(aligned_path, CALIBRATION_NAME), "w") as f:
+        json.dump(calibration, f, indent=2)
+
+    unaligned_path = modal_path + ".unaligned"
+    os.rename(modal_path, unaligned_path)
+    os.rename(aligned_path, modal_path)
+    shutil.rmtree(unaligned_path)
+    return modal_path, len(timestamps), time.time() - start_time
+
+
+def main():
+    args = parse_args()
+    takes = list(find_unaligned(args.path))
+    print("[info] {} takes to align".format(len(takes)))
+
+    with multiprocessing.Pool(args.jobs) as pool:
+        for modal_path, frame_count, elapsed in pool.imap_unordered(align_take, takes):
+            print("aligned {} frames in {:.1f}s ({:.1f} fps): {}".format(
+                frame_count, elapsed, frame_count / max(elapsed, 1e-6), modal_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# compares the depth_raw storage options on recorded or synthetic depth frames: compression ratio, encode and
+# decode speed on one core, and checks that every option is lossless.
+import argparse
+import io
+import time
+
+import cv2
+import numpy as np
+
+from reader.depth_codec import decode_depth, encode_depth
+from reader.depth_writers import load_depth_frames
+
+
+def parse_args():
+    par = argparse.ArgumentParser("lossless depth compression benchmark")
+    par.add_argument("depth_raw", nargs="?", default=None,
+                     help="a depth_raw folder of a take in any format, synthetic frames if omitted.")
+    par.add_argument("-n", "--frames", default=120, type=int, help="max number of frames to encode.")
+    par.add_argument("--levels", default="1,6", help="comma separated deflate levels of the depth codec.")
+    return par.parse_args()
+
+
+def synthetic_frames(n, height=480, width=848, seed=0):
+    # tilted, rippled surfaces with sensor noise and blocks of invalid (zero) pixels
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    frames = []
+    for i in range(n):
+        depth = 800 + x * 2 + y * 3 + 200 * np.sin(x / 40 + i / 5) + rng.normal(0, 4, size=x.shape)
+        holes = np.kron(rng.random((height // 8, width // 8)) < 0.1, np.ones((8, 8), dtype=bool))
+        depth[holes] = 0
+        frames.append(depth.clip(0, 65535).astype(np.uint16))
+    return frames
+
+
+def npy_codec():
+    def encode(frame):
+        f = io.BytesIO()
+        np.save(f, frame)
+        return f.getvalue()
+
+    def decode(data, height, width):
+        return np.load(io.BytesIO(data))
+
+    return encode, decode
+
+
+def png_codec(level):
+    params = [cv2.IMWRITE_PNG_COMPRESSION, level]
+
+    def encode(frame):
+        return cv2.imencode(".png", frame, params)[1].tobytes()
+
+    def decode(data, height, width):
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+    return encode, decode
+
+
+def depth_codec(level):
+    return lambda frame: encode_depth(frame, level), decode_depth
+
+
+def measure(encode, decode, frames):
+    height, width = frames[0].shape
+    start = time.perf_counter()
+    encoded = [encode(frame) for frame in frames]
+    encode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = [decode(data, height, width) for data in encoded]
+    decode_seconds = time.perf_counter() - start
+
+    lossless = all(np.array_equal(a, b) for a, b in zip(frames, decoded))
+    encoded_bytes = sum(len(data) for data in encoded)
+    return {
+        "ratio": sum(frame.nbytes for frame in frames) / encoded_bytes,
+        "kb_per_frame": encoded_bytes / len(frames) / 1024,
+        "encode_fps": len(frames) / encode_seconds,
+        "decode_fps": len(frames) / decode_seconds,
+        "lossless": lossless,
+    }
+
+
+def main():
+    args = parse_args()
+    if args.depth_raw is None:
+        frames = synthetic_frames(args.frames)
+    else:
+        frames, _ = load_depth_frames(args.depth_raw)
+        frames = [np.asarray(frames[i]) for i in range(min(len(frames), args.frames))]
+    print("{} frames of {}x{}".format(len(frames), frames[0].shape[1], frames[0].shape[0]))
+
+    codecs = [("np.save", npy_codec())]
+    codecs += [("png16 level {}".format(level), png_codec(level)) for level in (1, 3)]
+    codecs += [("depth codec level {}".format(level), depth_codec(int(level))) for level in args.levels.split(",")]
+
+    print("{:<22}{:>8}{:>12}{:>12}{:>12}{:>10}".format("codec", "ratio", "KB/frame", "encode fps", "decode fps",
+                                                       "lossless"))
+    for name, (encode, decode) in codecs:
+        r = measure(encode, decode, frames)
+        print("{:<22}{:>8.2f}{:>12.1f}{:>12.1f}{:>12.1f}{:>10}".format(
+            name, r["ratio"], r["kb_per_frame"], r["encode_fps"], r["decode_fps"], "yes" if r["lossless"] else "NO"))
+
+
+if __name__ == "__main__":
+    main()
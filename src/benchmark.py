@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# records takes from the synthetic readers through RecorderController and WriteProcedure, without a window or
+# sensors, and reports sustained fps, drop rate, take-to-disk latency and peak RSS of every scenario.
+# options after the benchmark options are passed to main.py, e.g. benchmark.py --takes 3 --png-compression 1
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+SCENARIOS = {
+    "buffered": [],
+    "stream": ["--stream-write"],
+    "container": ["--depth-format", "container"],
+    "stream-container": ["--stream-write", "--depth-format", "container"],
+    "compressed": ["--depth-format", "compressed"],
+    "video": ["--color-format", "video"],
+    "stream-video": ["--stream-write", "--color-format", "video", "--depth-format", "container"],
+}
+
+
+def parse_args():
+    par = argparse.ArgumentParser("capture to disk benchmark on synthetic sensors")
+    par.add_argument("--scenarios", default=",".join(SCENARIOS),
+                     help="comma separated scenarios out of {}.".format(", ".join(SCENARIOS)))
+    par.add_argument("--takes", default=5, type=int, help="takes recorded per scenario.")
+    par.add_argument("--take-seconds", default=10, type=float, help="length of a take.")
+    par.add_argument("--gap", default=2, type=float, help="seconds between two takes.")
+    par.add_argument("--drain-timeout", default=300, type=float, help="max seconds to wait for the writer at the end.")
+    par.add_argument("--bench-path", default=None, help="work folder, a temporary folder by default.")
+    par.add_argument("--keep", action="store_true", help="keep the recorded takes.")
+    par.add_argument("--out", default=None, help="write the results as json.")
+    return par.parse_known_args()
+
+
+class TakeCollector:
+    # finalizer of the writer, collects the frame report and the latency of every saved take
+
+    def __init__(self):
+        self.takes = []
+
+    def __call__(self, take_path):
+        saved = time.time()
+        with open(os.path.join(take_path, "frame_index", "clock.json")) as f:
+            stop = json.load(f)["triggers"]["stop"]["fired"]
+        with open(os.path.join(take_path, "frame_index", "realsense_report.json")) as f:
+            report = json.load(f)
+        take_bytes = sum(os.path.getsize(os.path.join(root, name))
+                         for root, dirs, files in os.walk(take_path) for name in files)
+        self.takes.append({
+            "path": take_path,
+            "latency": saved - stop,
+            "frames": report["frames"],
+            "dropped_frames": report.get("dropped_frames", 0),
+            "seconds": report["anchors"]["save"] - report["anchors"]["record"],
+            "bytes": take_bytes,
+        })
+
+
+def run_scenario(name, argv, bench):
+    # runs in its own process, so the peak RSS belongs to this scenario only
+    import main  # parse_args only, main.py imports Qt inside main()
+    from clock_recorder import ClockRecorder
+    from memory_budget import MemoryBudget
+    from reader import metrics
+    from reader.checksums import write_take_checksums
+    from reader.cross_index import build_cross_index
+    from reader.profiling import profiler
+    from reader.synthetic_reader import SyntheticEventReader, SyntheticRgbdReader
+    from recorder_controller import RecorderController
+    from write_procedure import WriteProcedure
+
+    args = main.parse_args(argv)
+    metrics.registry.enabled = True
+    os.makedirs(args.path, exist_ok=True)
+
+    controller = RecorderController(args)
+    writer = WriteProcedure(args, controller)
+    collector = TakeCollector()
+    writer.register_finalizer(build_cross_index)
+    writer.register_finalizer(write_take_checksums)
+    writer.register_finalizer(collector)
+    writer.start()
+    memory_budget = MemoryBudget(args, controller)
+    memory_budget.start()
+    writer.register_readable(ClockRecorder(args, controller))
+
+    realsense_reader = SyntheticRgbdReader(args, controller)
+    realsense_reader.register_memory_budget(memory_budget)
+    realsense_reader.start()
+    writer.register_readable(realsense_reader)
+    event_reader = SyntheticEventReader(args, controller)
+    event_reader.start()
+    writer.register_readable(event_reader)
+    profiler.enabled = args.profile
+    controller.register_reader(profiler)
+
+    time.sleep(1)
+    refused = 0
+    for _ in range(bench.takes):
+        if not controller.set_record():
+            refused += 1
+            time.sleep(bench.take_seconds + bench.gap)
+            continue
+        time.sleep(bench.take_seconds)
+        controller.set_stop()
+        time.sleep(bench.gap)
+
+    drain_start = time.time()
+    while writer.queue_depth() > 0 and time.time() - drain_start < bench.drain_timeout:
+        time.sleep(0.1)
+    drain = time.time() - drain_start
+
+    realsense_reader.stop()
+    event_reader.stop()
+    writer.stop()
+    memory_budget.stop()
+    controller.stop()
+
+    takes = collector.takes
+    frames = sum(t["frames"] for t in takes)
+    dropped = sum(t["dropped_frames"] for t in takes)
+    latency = [t["latency"] for t in takes]
+    return {
+        "scenario": name,
+        "argv": argv,
+        "takes": len(takes),
+        "refused": refused,
+        "fps": frames / max(sum(t["seconds"] for t in takes), 1e-6),
+        "drop_rate": dropped / max(frames + dropped, 1),
+        "latency_p50": float(np.percentile(latency, 50)) if takes else float("nan"),
+        "latency_max": max(latency) if takes else float("nan"),
+        "drain": drain,
+        "write_mbps": writer.write_bps / 1e6,
+        "take_mb": sum(t["bytes"] for t in takes) / max(len(takes), 1) / 1e6,
+        # ru_maxrss is in KB on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": metrics.stage_summary(),
+    }
+
+
+def run_in_process(name, argv, bench):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_scenario, (name, argv, bench))
+
+
+def main():
+    bench, rest = parse_args()
+    bench_path = bench.bench_path or tempfile.mkdtemp(prefix="capture_benchmark.")
+
+    results = []
+    for name in bench.scenarios.split(","):
+        path = os.path.join(bench_path, name)
+        argv = ["--synthetic", "--master", "--broadcast-addr", "127.255.255.255", "--path", path] + rest + \
+            SCENARIOS[name]
+        print("[bench] running {}: {}".format(name, " ".join(argv)))
+        results.append(run_in_process(name, argv, bench))
+        if not bench.keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+    print("")
+    print("{:<18}{:>6}{:>8}{:>8}{:>11}{:>11}{:>9}{:>10}{:>10}{:>10}".format(
+        "scenario", "takes", "fps", "drop%", "lat p50 s", "lat max s", "drain s", "write MB/s", "take MB",
+        "peak RSS"))
+    for r in results:
+        print("{:<18}{:>6}{:>8.2f}{:>8.2f}{:>11.2f}{:>11.2f}{:>9.2f}{:>10.1f}{:>10.1f}{:>10.0f}".format(
+            r["scenario"], "{}/{}".format(r["takes"], bench.takes), r["fps"], r["drop_rate"] * 100, r["latency_p50"],
+            r["latency_max"], r["drain"], r["write_mbps"], r["take_mb"], r["peak_rss_mb"]))
+
+    if bench.out:
+        with open(bench.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if not bench.keep and bench.bench_path is None:
+        shutil.rmtree(bench_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
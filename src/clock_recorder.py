@@ -0,0 +1,50 @@
+import json
+import os
+import time
+
+from reader.readable import Readable
+from reader.reader_callback import ReaderCallback
+from recorder_controller import RecorderController
+
+
+class ClockRecorder(ReaderCallback, Readable):
+    # stores the station's estimate of the master clock with every take, so takes of several stations can be
+    # put on the master timebase: master_time = local_time + offset. the record / stop trigger errors of the take
+    # are stored along with it.
+
+    def __init__(self, args, controller: RecorderController):
+        self.args = args
+        self.controller = controller
+        self.controller.register_reader(self)
+
+    def snapshot(self):
+        network_controller = self.controller.network_controller
+        d = {"time": time.time()}
+        if self.args.master:
+            d.update({"role": "master", "offset": 0.0, "rtt": 0.0, "samples": 0})
+            d["clients"] = {"{}:{}".format(*address): clock
+                            for address, clock in network_controller.clock_table().items()}
+        else:
+            d.update({"role": "client", "master": network_controller.host})
+            d.update(network_controller.clock.snapshot())
+        d["triggers"] = dict(self.controller.triggers)
+        return d
+
+    def notify_record(self):
+        pass
+
+    def notify_save(self, aid, pid, sid):
+        self.push((aid, pid, sid), [("frame_index", self.save_data, self.snapshot())])
+
+    def notify_cancel(self):
+        pass
+
+    def describe_parts(self, parts):
+        return [{"snapshot": modal_data} for _, _, modal_data in parts]
+
+    def restore_parts(self, description):
+        return [("frame_index", self.save_data, d["snapshot"]) for d in description]
+
+    def save_data(self, modal_path, modal_data):
+        with open(os.path.join(modal_path, "clock.json"), "w") as f:
+            json.dump(modal_data, f, indent=2)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# dataset level index of the recorded takes, so tools can ask what has been recorded without walking the tree.
+#
+#   python3 dataset_manifest.py --path ./dataset list -a 37
+#   python3 dataset_manifest.py --path ./dataset summary
+#   python3 dataset_manifest.py --path ./dataset rebuild
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from reader.cross_index import ANCHORS_NAME
+
+MANIFEST_NAME = "manifest.sqlite"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS takes (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    aid INTEGER NOT NULL,
+    pid INTEGER NOT NULL,
+    sid INTEGER NOT NULL,
+    station TEXT,
+    frames INTEGER,
+    event_bytes INTEGER,
+    duration REAL,
+    bytes INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    recorded REAL,
+    committed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS takes_person ON takes (aid, pid, sid);
+CREATE INDEX IF NOT EXISTS takes_pid ON takes (pid);
+CREATE TABLE IF NOT EXISTS modals (
+    take_id INTEGER NOT NULL REFERENCES takes (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (take_id, name)
+);
+"""
+TAKE_COLUMNS = ("path", "aid", "pid", "sid", "station", "frames", "event_bytes", "duration", "bytes", "files",
+                "recorded", "committed")
+TAKE_PATTERN = re.compile(r"A(\d{4})P(\d{4})[/\\]S(\d+)$")
+
+
+class DatasetManifest:
+    # sqlite index of the takes under a dataset root: one row per take in `takes`, one row per modal directory in
+    # `modals`. paths are relative to the dataset root, so a take keeps its row when the take mover moves it from
+    # the spool. a take is added in one transaction when the writer commits it.
+
+    def __init__(self, path, station=None):
+        self.path = os.path.join(path, MANIFEST_NAME)
+        self.station = station
+        self.lock = threading.Lock()
+        self.is_new = not os.path.exists(self.path)
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def add_take(self, take_path):
+        # indexes the take directory, replacing the row of a take with the same path
+        row, modals = describe_take(take_path)
+        row["station"] = self.station
+        row["committed"] = time.time()
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM takes WHERE path = ?", (row["path"],))
+            take_id = self.db.execute("INSERT INTO takes ({}) VALUES ({})".format(
+                ", ".join(TAKE_COLUMNS), ", ".join("?" * len(TAKE_COLUMNS))),
+                [row[name] for name in TAKE_COLUMNS]).lastrowid
+            self.db.executemany("INSERT INTO modals (take_id, name, path, files, bytes) VALUES (?, ?, ?, ?, ?)",
+                                [(take_id,) + modal for modal in modals])
+        return row
+
+    def take_numbers(self, aid, pid):
+        with self.lock:
+            return [r[0] for r in self.db.execute("SELECT sid FROM takes WHERE aid = ? AND pid = ?", (aid, pid))]
+
+    def takes(self, aid=None, pid=None, sid=None, station=None):
+        # rows of the matching takes as dicts, ordered by aid, pid, sid
+        where, values = [], []
+        for name, value in (("aid", aid), ("pid", pid), ("sid", sid), ("station", station)):
+            if value is not None:
+                where.append("{} = ?".format(name))
+                values.append(value)
+        query = "SELECT * FROM takes"
+        if len(where) > 0:
+            query += " WHERE " + " AND ".join(where)
+        with self.lock:
+            return [dict(r) for r in self.db.execute(query + " ORDER BY aid, pid, sid", values)]
+
+    def modals(self, take_path):
+        with self.lock:
+            return [dict(r) for r in self.db.execute(
+                "SELECT modals.name, modals.path, modals.files, modals.bytes FROM modals "
+                "JOIN takes ON takes.id = modals.take_id WHERE takes.path = ? ORDER BY modals.name", (take_path,))]
+
+    def summary(self):
+        with self.lock:
+            return [dict(r) for r in self.db.execute(
+                "SELECT aid, COUNT(*) AS takes, COUNT(DISTINCT pid) AS people, SUM(frames) AS frames, "
+                "SUM(duration) AS duration, SUM(bytes) AS bytes FROM takes GROUP BY aid ORDER BY aid")]
+
+    def rebuild(self, *roots):
+        # indexes every take directory under `roots` and drops the rows of takes that are gone
+        found = set()
+        start = time.time()
+        for take_path in (take_path for root in roots for take_path in find_takes(root)):
+            found.add(self.add_take(take_path)["path"])
+            if len(found) % 1000 == 0:
+                print("DatasetManifest: {} takes indexed, {:.0f} takes/s".format(
+                    len(found), len(found) / max(time.time() - start, 1e-6)))
+        with self.lock, self.db:
+            gone = [r[0] for r in self.db.execute("SELECT path FROM takes") if r[0] not in found]
+            self.db.executemany("DELETE FROM takes WHERE path = ?", [(path,) for path in gone])
+        print("DatasetManifest: {} takes indexed, {} removed in {:.1f}s".format(
+            len(found), len(gone), time.time() - start))
+
+
+def find_takes(root):
+    for person_name in sorted(os.listdir(root)):
+        person_path = os.path.join(root, person_name)
+        if not re.fullmatch(r"A\d{4}P\d{4}", person_name) or not os.path.isdir(person_path):
+            continue
+        for take_name in sorted(os.listdir(person_path)):
+            if re.fullmatch(r"S\d+", take_name):
+                yield os.path.join(person_path, take_name)
+
+
+def describe_take(take_path):
+    # (take row, [(modal name, modal path, files, bytes)]) of a take directory
+    take_name = os.path.join(*os.path.normpath(take_path).split(os.sep)[-2:])
+    match = TAKE_PATTERN.search(take_name)
+    if match is None:
+        raise ValueError("{} is not a A####P####/S## take".format(take_path))
+    row = {"path": take_name, "aid": int(match.group(1)), "pid": int(match.group(2)), "sid": int(match.group(3)),
+           "frames": None, "event_bytes": None, "duration": None, "recorded": None}
+
+    modals = []
+    for modal_name in sorted(os.listdir(take_path)):
+        modal_path = os.path.join(take_path, modal_name)
+        if not os.path.isdir(modal_path):
+            continue
+        sizes = [os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(modal_path)
+                 for name in files]
+        modals.append((modal_name, os.path.join(take_name, modal_name), len(sizes), sum(sizes)))
+        if modal_name == "event":
+            row["event_bytes"] = sum(sizes)
+    row["files"] = sum(modal[2] for modal in modals)
+    row["bytes"] = sum(modal[3] for modal in modals)
+
+    anchors = {}
+    index_path = os.path.join(take_path, "frame_index")
+    try:
+        with open(os.path.join(index_path, "realsense_report.json")) as f:
+            report = json.load(f)
+        row["frames"] = report.get("frames")
+        anchors = report.get("anchors", {})
+    except (OSError, ValueError):
+        try:
+            with open(os.path.join(index_path, ANCHORS_NAME)) as f:
+                anchors = json.load(f)
+        except (OSError, ValueError):
+            pass
+    if "record" in anchors:
+        row["recorded"] = anchors["record"]
+        if "save" in anchors:
+            row["duration"] = anchors["save"] - anchors["record"]
+    return row, modals
+
+
+def parse_args():
+    par = argparse.ArgumentParser("query the take manifest of a dataset")
+    par.add_argument("--path", default="./dataset", help="the dataset folder.")
+    sub = par.add_subparsers(dest="command", required=True)
+    query = sub.add_parser("list", help="list takes, all of them if no filter is given.")
+    query.add_argument("-a", "--aid", default=None, type=int)
+    query.add_argument("-p", "--pid", default=None, type=int)
+    query.add_argument("-s", "--sid", default=None, type=int)
+    query.add_argument("--station", default=None)
+    query.add_argument("--modals", action="store_true", help="list the modal directories of every take as well.")
+    query.add_argument("--json", action="store_true", help="print one json object per take.")
+    sub.add_parser("summary", help="takes, people, frames, duration and size per action.")
+    sub.add_parser("rebuild", help="index the takes on disk again, for datasets recorded without a manifest.")
+    return par.parse_args()
+
+
+def main():
+    args = parse_args()
+    manifest = DatasetManifest(args.path)
+    if args.command == "rebuild":
+        manifest.rebuild(args.path)
+    elif args.command == "summary":
+        print("{:>6}{:>8}{:>8}{:>10}{:>10}{:>10}".format("aid", "takes", "people", "frames", "minutes", "GB"))
+        for r in manifest.summary():
+            print("{:>6}{:>8}{:>8}{:>10}{:>10.1f}{:>10.2f}".format(
+                r["aid"], r["takes"], r["people"], r["frames"] or 0, (r["duration"] or 0) / 60, r["bytes"] / 1e9))
+    else:
+        start = time.perf_counter()
+        takes = manifest.takes(args.aid, args.pid, args.sid, args.station)
+        elapsed = time.perf_counter() - start
+        for r in takes:
+            if args.json:
+                print(json.dumps(r))
+            else:
+                print("{}  station {}  {} frames  {:.1f}s  {:.1f} MB".format(
+                    r["path"], r["station"], r["frames"], r["duration"] or 0, r["bytes"] / 1e6))
+            if args.modals:
+                for modal in manifest.modals(r["path"]):
+                    print("    {:<12}{:>8} files{:>10.1f} MB".format(
+                        modal["name"], modal["files"], modal["bytes"] / 1e6))
+        print("{} takes in {:.1f} ms".format(len(takes), elapsed * 1000))
+    manifest.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,21 @@
 
 import argparse
 import os
+import signal
+import socket
 import sys
-
-from PyQt5.QtWidgets import QApplication
-
-from MainWindow import MainWindow
-from reader.event_reader import EventReader, EventCameraError
-from reader.realsense_reader import RealsenseReader, RealSenseError
+import time
+
+from clock_recorder import ClockRecorder
+from memory_budget import MemoryBudget
+from metrics_server import MetricsServer
+from reader import metrics
+from reader.checksums import write_take_checksums
+from reader.cross_index import build_cross_index
+from reader.profiling import profiler
+from reader.synthetic_reader import SyntheticEventReader, SyntheticRgbdReader
 from recorder_controller import RecorderController
+from take_mover import TakeMover
 from write_procedure import WriteProcedure
 
 
@@ -38,74 +45,200 @@ class Layouts:
                 yield v
 
 
-def parse_args():
+def parse_args(argv=None):
     par = argparse.ArgumentParser("dataset capture tool")
     par.add_argument("--path", default="./dataset", help="the work folder for storing results")
+    par.add_argument("--spool-path", default=None,
+                     help="fast local folder takes are written to first, finished takes are moved to --path.")
+    par.add_argument("--mover-bandwidth", default=100, type=float,
+                     help="max MB/s of moving takes from --spool-path to --path, 0 for no limit.")
 
+    par.add_argument("--station", default=socket.gethostname(),
+                     help="name of this station in the dataset manifest.")
     par.add_argument("-M", "--master", action="store_true", help="start the datset capture tool as master.")
     par.add_argument("--broadcast-addr", default="10.12.41.255", help="the broadcast address for network sync.")
     par.add_argument("--port", type=int, default=30728, help="communication port number for network sync.")
+    par.add_argument("--sync-retries", default=5, type=int, help="max retransmissions of a sync command.")
+    par.add_argument("--sync-retry-interval", default=0.02, type=float,
+                     help="seconds between retransmissions of an unacknowledged sync command.")
+    par.add_argument("--clock-interval", default=1.0, type=float,
+                     help="seconds between clock offset measurements of a client.")
+    par.add_argument("--status-interval", default=1.0, type=float,
+                     help="seconds between status reports of a client to the master.")
+    par.add_argument("--sync-engine", default="thread", choices=["thread", "asyncio"],
+                     help="thread polls the sync socket, asyncio dispatches sync commands as they arrive.")
+    par.add_argument("--sync-groups", default=None,
+                     help="comma separated broadcast / multicast addr[:port] of the asyncio sync engine, "
+                          "defaults to --broadcast-addr.")
+    par.add_argument("--health-policy", default="warn", choices=["warn", "refuse"],
+                     help="what the master does when a station is unhealthy before a take.")
+    par.add_argument("--max-write-queue", default=4, type=int, help="max takes waiting for the writer of a healthy station.")
+    par.add_argument("--max-pending", default=4096, type=int,
+                     help="max MB of buffered takes waiting for the writer of a healthy station.")
+    par.add_argument("--min-free-disk", default=20, type=float, help="min GB of free disk of a healthy station.")
+    par.add_argument("--min-capture-fps", default=50, type=float, help="min realsense fps of a healthy station.")
+    par.add_argument("--sync-lead", default=0.2, type=float,
+                     help="seconds between a record / stop command of the master and its synchronized deadline.")
 
     par.add_argument("-a", "--aid", default=0, type=int)
     par.add_argument("-s", "--sid", default=0, type=int)
     par.add_argument("-p", "--pid", default=0, type=int)
 
+    par.add_argument("--stream-write", action="store_true",
+                     help="write realsense frames to disk while recording instead of buffering the whole take.")
+    par.add_argument("--stream-window", default=120, type=int,
+                     help="max number of realsense frames held in memory in stream write mode.")
+
+    par.add_argument("--png-workers", default=4, type=int, help="number of threads encoding color PNGs.")
+    par.add_argument("--png-compression", default=3, type=int, choices=range(10),
+                     help="PNG compression level of color frames, 0 (fastest) to 9 (smallest).")
+    par.add_argument("--color-format", default="png", choices=["png", "video"],
+                     help="color storage, one PNG per frame or one lossless FFV1 video per take.")
+    par.add_argument("--depth-format", default="npy", choices=["npy", "container", "compressed"],
+                     help="depth_raw storage, one .npy per frame, a single memory-mappable container per take "
+                          "or a single losslessly compressed file per take.")
+    par.add_argument("--arena-chunk", default=60, type=int,
+                     help="number of realsense frames per preallocated buffer block while recording.")
+    par.add_argument("--write-takes", default=2, type=int, help="max number of takes written at the same time.")
+    par.add_argument("--write-workers", default=4, type=int,
+                     help="max number of modalities written at the same time, over all takes.")
+    par.add_argument("--memory-budget", default=8192, type=int,
+                     help="MB of memory for takes waiting to be written, takes over budget are spilled, 0 to disable.")
+    par.add_argument("--scratch-path", default=None,
+                     help="local folder for spilled takes, defaults to .scratch under --path.")
+    par.add_argument("--raw-capture", action="store_true",
+                     help="store unaligned depth with the stream calibration, align later with align_depth.py.")
+
+    par.add_argument("--fpn-file", default="/home/event/Desktop/record_dataset_net/FPN_lab.txt",
+                     help="fixed pattern noise file of the event camera.")
+    par.add_argument("--synthetic", action="store_true",
+                     help="record generated color / depth frames and event data instead of the sensors.")
+    par.add_argument("--synthetic-fps", default=60, type=float, help="frame rate of the synthetic color / depth frames.")
+    par.add_argument("--synthetic-event-rate", default=16, type=float, help="MB/s of synthetic event data.")
+
+    par.add_argument("--metrics-port", default=0, type=int,
+                     help="serve prometheus metrics on http://127.0.0.1:<port>/metrics, 0 to disable.")
+    par.add_argument("--take-metrics", action="store_true",
+                     help="collect metrics and store a per take summary in frame_index/metrics.json.")
+
+    par.add_argument("--profile", action="store_true",
+                     help="cProfile the reader / writer threads and trace allocations of each take into <take>/profile.")
+
     layouts = Layouts()
+    par.add_argument("--preview-fps", default=30, type=float,
+                     help="max frames per second of the realsense and event previews.")
     par.add_argument("-L", "--layout", default="portrait", choices=layouts, type=lambda x: layouts[x])
 
-    return par.parse_args()
+    args = par.parse_args(argv)
+    # with a spool everything is written under the spool, the take mover migrates finished takes to --path
+    args.dataset_path = args.path
+    if args.spool_path is not None:
+        args.path = args.spool_path
+    return args
+
+
+def open_sensors(args, controller, shutdown):
+    # the sensor SDKs are only imported here, so --synthetic and benchmark.py run without them
+    from reader.event_reader import EventReader, EventCameraError
+    from reader.realsense_reader import RealsenseReader, RealSenseError
+
+    try:
+        print("[info] Waiting for sensor ...")
+        realsense_reader = RealsenseReader(args, controller)
+        print("[info] Realsense sensor opened.")
+    except RealSenseError:
+        shutdown()
+        print("Failed to open Realsense Camera.")
+        exit(-1)
+
+    try:
+        print("")
+        event_reader = EventReader(args, controller)
+        print("[info] Event camera opened.")
+    except EventCameraError:
+        realsense_reader.stop()
+        shutdown()
+        print("Failed to open Event Camera.")
+        exit(-2)
+
+    return realsense_reader, event_reader
 
 
 def main():
+    # Qt is only imported here, so benchmark.py can share parse_args on a headless machine
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    from MainWindow import MainWindow
+
     args = parse_args()
 
-    path_base = args.path
+    for path_base in (args.path, args.dataset_path):
+        if not os.path.exists(path_base):
+            os.makedirs(path_base)
 
-    if not os.path.exists(path_base):
-        os.makedirs(path_base)
+        if not os.path.isdir(path_base):
+            print("Path is invalid")
+            sys.exit()
 
-    if not os.path.isdir(path_base):
-        print("Path is invalid")
-        sys.exit()
+    metrics.registry.enabled = args.metrics_port > 0 or args.take_metrics
+    metrics_server = None
+    if args.metrics_port > 0:
+        metrics_server = MetricsServer(args)
+        metrics_server.start()
 
     controller = RecorderController(args)
+    profiler.enabled = args.profile
 
     if not args.master:
         controller.start()
 
     writer = WriteProcedure(args, controller)
+    writer.register_finalizer(build_cross_index)
+    writer.register_finalizer(write_take_checksums)
     writer.start()
 
+    mover = None
+    if args.spool_path is not None:
+        # registered last, the other finalizers read the take from the spool
+        mover = TakeMover(args, controller, writer)
+        writer.register_finalizer(mover.enqueue)
+        mover.start()
+
+    memory_budget = MemoryBudget(args, controller)
+    memory_budget.start()
+
+    clock_recorder = ClockRecorder(args, controller)
+    writer.register_readable(clock_recorder)
+
     app = QApplication([""])
     window = MainWindow(args, controller)
 
     writer.register_window(window)
+    memory_budget.register_window(window)
     controller.register_window(window)
 
     window.show()
 
-    try:
-        print("[info] Waiting for sensor ...")
-        realsense_reader = RealsenseReader(args, controller)
-        print("[info] Realsense sensor opened.")
-    except RealSenseError:
+    def shutdown():
         writer.stop()
+        if mover is not None:
+            mover.stop()
+        memory_budget.stop()
         controller.stop()
-        print("Failed to open Realsense Camera.")
-        exit(-1)
+        if metrics_server is not None:
+            metrics_server.stop()
 
-    try:
-        print("")
-        event_reader = EventReader(args, controller)
-        print("[info] Event camera opened.")
-    except EventCameraError:
-        realsense_reader.stop()
-        writer.stop()
-        controller.stop()
-        print("Failed to open Event Camera.")
-        exit(-2)
+    if args.synthetic:
+        realsense_reader = SyntheticRgbdReader(args, controller)
+        event_reader = SyntheticEventReader(args, controller)
+    else:
+        realsense_reader, event_reader = open_sensors(args, controller, shutdown)
+
+    controller.register_reader(profiler)
 
     realsense_reader.register_window(window)
+    realsense_reader.register_memory_budget(memory_budget)
     realsense_reader.start()
     writer.register_readable(realsense_reader)
 
@@ -113,20 +246,37 @@ def main():
     event_reader.start()
     writer.register_readable(event_reader)
 
-    while True:
-        try:
-            app.processEvents()
-
-            if not window.isVisible():
-                break
-
-        except KeyboardInterrupt:
-            break
-
+    # takes of a previous run that was killed or closed with a non-empty write queue
+    writer.recover()
+
+    # Ctrl-C quits the event loop, the timer gives the interpreter a chance to run the signal handler
+    # while Qt is blocked waiting for events.
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(200)
+
+    # idle, the ui thread used 98% of one core in the previous processEvents() polling loop and 0.1% in exec_()
+    # (10 s with an offscreen window, 5.15 Qt, no cameras). the line printed at exit tracks it on the station.
+    wall_start, ui_cpu_start, cpu_start = time.time(), time.thread_time(), time.process_time()
+    app.exec_()
+    wall = max(time.time() - wall_start, 1e-6)
+    print("[info] cpu usage over {:.0f}s: ui thread {:.1f}%, process {:.1f}% of one core".format(
+        wall, (time.thread_time() - ui_cpu_start) / wall * 100, (time.process_time() - cpu_start) / wall * 100))
+    print("[info] preview cpu usage: realsense {:.1f}%, event {:.1f}% of one core, {} / {} frames dropped".format(
+        realsense_reader.preview.cpu_seconds / wall * 100, event_reader.preview.cpu_seconds / wall * 100,
+        realsense_reader.preview.dropped, event_reader.preview.dropped))
+
+    signal_timer.stop()
     realsense_reader.stop()
     event_reader.stop()
     writer.stop()
+    if mover is not None:
+        mover.stop()
+    memory_budget.stop()
     controller.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
 
     sys.exit(0)
 
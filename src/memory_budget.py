@@ -0,0 +1,117 @@
+import os
+import shutil
+import threading
+
+from reader import metrics
+from reader.reader_callback import ReaderCallback
+from reader.runnable import Runnable
+from reader.utils import random_string
+from recorder_controller import RecorderController
+
+
+class MemoryBudget(Runnable, ReaderCallback):
+    # keeps the frames of takes that wait for the writer under `args.memory_budget` MB of memory by spilling the
+    # most recent takes to scratch files, and refuses new takes while the budget can't be met.
+
+    def __init__(self, args, controller: RecorderController):
+        super(MemoryBudget, self).__init__(args)
+        self.budget = args.memory_budget * 1024 * 1024
+        self.scratch_path = args.scratch_path or os.path.join(args.path, ".scratch")
+        self.takes = []
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.window = None
+        if self.budget > 0:
+            os.makedirs(self.scratch_path, exist_ok=True)
+            self.remove_stale_spills()
+        controller.register_reader(self)
+        metrics.registry.gauge("recorder_pending_bytes", "bytes of takes waiting for the writer.", self.pending_bytes)
+        metrics.registry.gauge("recorder_spilled_bytes", "bytes of waiting takes spilled to scratch files.",
+                               self.spilled_bytes)
+
+    def remove_stale_spills(self):
+        # spilled takes don't outlive the process, files left by a previous run can't be written any more
+        for name in os.listdir(self.scratch_path):
+            if name.startswith("spill."):
+                print("MemoryBudget: removing stale", os.path.join(self.scratch_path, name))
+                os.remove(os.path.join(self.scratch_path, name))
+
+    def register_window(self, window):
+        self.window = window
+
+    def track(self, write_info):
+        with self.lock:
+            self.takes.append(write_info)
+        self.changed.set()
+
+    def untrack(self, write_info):
+        with self.lock:
+            if write_info in self.takes:
+                self.takes.remove(write_info)
+        self.changed.set()
+
+    def memory_bytes(self):
+        with self.lock:
+            return sum(t.nbytes for t in self.takes)
+
+    def pending_bytes(self):
+        with self.lock:
+            return sum(t.used_bytes for t in self.takes)
+
+    def spilled_bytes(self):
+        with self.lock:
+            return sum(t.used_bytes for t in self.takes if t.is_spilled)
+
+    def report_status(self):
+        return {"pending_bytes": self.pending_bytes(), "spilled_bytes": self.spilled_bytes(),
+                "memory_budget": self.budget, "budget_refusal": self.refusal()}
+
+    def refusal(self):
+        # why a new take would be refused, None while the budget can be met
+        if self.budget <= 0:
+            return None
+        in_memory = self.memory_bytes()
+        if in_memory > self.budget:
+            return "{:.0f} MB buffered in memory, budget is {:.0f} MB".format(in_memory / 2 ** 20, self.budget / 2 ** 20)
+        free = shutil.disk_usage(self.scratch_path).free
+        if free < self.budget:
+            return "only {:.0f} MB free for spilling in {}".format(free / 2 ** 20, self.scratch_path)
+        return None
+
+    def accept_record(self):
+        refusal = self.refusal()
+        if refusal is not None:
+            print("MemoryBudget: refusing to record,", refusal)
+            return False
+        return True
+
+    def spill_over_budget(self):
+        # the take is chosen under the lock and spilled outside of it, a spill writes up to gigabytes and status
+        # reports and accept_record must not wait for it. takes the writer is saving are left in memory
+        while self.working:
+            with self.lock:
+                in_memory = sum(t.nbytes for t in self.takes)
+                if in_memory <= self.budget:
+                    return
+                candidates = [t for t in reversed(self.takes)
+                              if not t.is_spilled and not t.spilling and not t.saving and t.used_bytes > 0]
+                if len(candidates) == 0:
+                    return
+                write_info = candidates[0]
+                write_info.spilling = True
+            print("MemoryBudget: {:.0f} MB buffered over the budget of {:.0f} MB, spilling {:.0f} MB".format(
+                in_memory / 2 ** 20, self.budget / 2 ** 20, write_info.used_bytes / 2 ** 20))
+            try:
+                if not write_info.spill(os.path.join(self.scratch_path, "spill.{}".format(random_string(5)))):
+                    print("MemoryBudget: the writer started saving the take, not spilled")
+            finally:
+                write_info.spilling = False
+
+    def proc(self):
+        while self.working:
+            self.changed.wait(timeout=0.5)
+            self.changed.clear()
+            if self.budget > 0:
+                self.spill_over_budget()
+            if self.window:
+                self.window.signal_pending_bytes.emit(self.pending_bytes(), self.spilled_bytes())
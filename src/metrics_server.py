@@ -0,0 +1,39 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from reader import metrics
+from reader.runnable import Runnable
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.registry.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(Runnable):
+    # serves the metrics registry in prometheus text format on http://127.0.0.1:<args.metrics_port>/metrics
+
+    def __init__(self, args):
+        super(MetricsServer, self).__init__(args)
+        self.server = ThreadingHTTPServer(("127.0.0.1", args.metrics_port), MetricsHandler)
+        self.server.daemon_threads = True
+        print("[info] metrics served on http://{}:{}/metrics".format(*self.server.server_address))
+
+    def stop(self):
+        if self.working:
+            self.server.shutdown()
+        super(MetricsServer, self).stop()
+        self.server.server_close()
+
+    def proc(self):
+        self.server.serve_forever(poll_interval=0.5)
@@ -1,7 +1,10 @@
 import argparse
-import json
+import collections
+import os
+import random
 import socket
 import struct
+import threading
 import time
 
 SO_TIMESTAMPING = 37
@@ -20,21 +23,176 @@ SOF_TIMESTAMPING_OPT_CMSG = (1 << 10)
 SOF_TIMESTAMPING_OPT_TSONLY = (1 << 11)
 
 
+CTRL_UPDATE = 0
+CTRL_RECORD = 1
+CTRL_STOP = 2
+CTRL_CANCEL = 3
+CTRL_NAMES = ["update", "record", "stop", "cancel"]
+
+KIND_COMMAND = 1
+KIND_ACK = 2
+KIND_PING = 3
+KIND_PONG = 4
+KIND_BEACON = 5
+KIND_STATUS = 6
+
+# fixed layout of every sync datagram, little endian:
+#   magic, version, kind, ctrl, flags, session, seq, t, at, aid, pid, sid
+# t is the master send time, at the master time the command takes effect (0 for now).
+# session is random per server instance, so clients can tell a restarted server from a duplicate.
+# ping / pong use the CLOCK layout instead:
+#   magic, version, kind, ctrl, flags, session, seq, t1, t2, t3, offset, rtt
+# t1 client send, t2 server receive, t3 server send, offset / rtt the client's current estimate.
+# periodic station status uses the STATUS layout:
+#   magic, version, kind, ctrl, flags, session, seq, t, queue_depth, pending_bytes, write_bps, free_disk,
+#   dropped_frames, capture_fps
+MAGIC = b"CDSY"
+VERSION = 2
+PREFIX = struct.Struct("<4sBB")
+MESSAGE = struct.Struct("<4sBBBBIIddiii")
+CLOCK = struct.Struct("<4sBBBBIIddddd")
+STATUS = struct.Struct("<4sBBBBIIdIQdQQd")
+STATUS_FIELDS = ["queue_depth", "pending_bytes", "write_bps", "free_disk", "dropped_frames", "capture_fps"]
+
+
+def pack_message(kind, ctrl, session, seq, t, aid, pid, sid, flags=0, at=0.0):
+    return MESSAGE.pack(MAGIC, VERSION, kind, ctrl, flags, session, seq, t, at, aid, pid, sid)
+
+
+def pack_clock(kind, session, seq, t1, t2=0.0, t3=0.0, offset=0.0, rtt=0.0):
+    return CLOCK.pack(MAGIC, VERSION, kind, 0, 0, session, seq, t1, t2, t3, offset, rtt)
+
+
+def pack_status(seq, status):
+    return STATUS.pack(MAGIC, VERSION, KIND_STATUS, 0, 0, 0, seq, time.time(),
+                       int(status.get("queue_depth", 0)), int(status.get("pending_bytes", 0)),
+                       float(status.get("write_bps", 0.0)), int(status.get("free_disk", 0)),
+                       int(status.get("dropped_frames", 0)), float(status.get("capture_fps", 0.0)))
+
+
+def unpack_message(raw):
+    if len(raw) < PREFIX.size:
+        raise ValueError("unexpected message size {}".format(len(raw)))
+    magic, version, kind = PREFIX.unpack_from(raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("unsupported message {} v{}".format(magic, version))
+
+    if kind in (KIND_PING, KIND_PONG):
+        if len(raw) != CLOCK.size:
+            raise ValueError("unexpected clock message size {}".format(len(raw)))
+        _, _, kind, ctrl, flags, session, seq, t1, t2, t3, offset, rtt = CLOCK.unpack(raw)
+        return {
+            "kind": kind, "session": session, "seq": seq,
+            "t1": t1, "t2": t2, "t3": t3, "offset": offset, "rtt": rtt,
+        }
+
+    if kind == KIND_STATUS:
+        if len(raw) != STATUS.size:
+            raise ValueError("unexpected status message size {}".format(len(raw)))
+        values = STATUS.unpack(raw)
+        d = {"kind": kind, "seq": values[6], "t": values[7]}
+        d.update(zip(STATUS_FIELDS, values[8:]))
+        return d
+
+    if len(raw) != MESSAGE.size:
+        raise ValueError("unexpected message size {}".format(len(raw)))
+    _, _, kind, ctrl, flags, session, seq, t, at, aid, pid, sid = MESSAGE.unpack(raw)
+    return {
+        "kind": kind, "ctrl": CTRL_NAMES[ctrl] if ctrl < len(CTRL_NAMES) else None, "flags": flags,
+        "session": session, "seq": seq, "t": t, "at": at, "aid": aid, "pid": pid, "sid": sid,
+    }
+
+
+def rx_timestamp(ancdata):
+    # kernel receive time from SO_TIMESTAMPNS ancillary data, 0 if the kernel didn't provide it
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level != socket.SOL_SOCKET or cmsg_type != SO_TIMESTAMPNS:
+            continue
+        if len(cmsg_data) >= 16:
+            sec, nsec = struct.unpack_from("qq", cmsg_data)
+        else:
+            sec, nsec = struct.unpack_from("ii", cmsg_data)
+        return sec + nsec * 1e-9
+    return 0
+
+
+class ClockEstimator:
+    # NTP style estimate of the master clock, offset is master time - local time.
+    # of the last `window` exchanges the one with the smallest round trip is trusted, it suffers least from queuing.
+
+    def __init__(self, window=16):
+        self.samples = collections.deque(maxlen=window)
+        self.offset = 0.0
+        self.rtt = float("nan")
+        self.count = 0
+
+    def add(self, t1, t2, t3, t4):
+        rtt = (t4 - t1) - (t3 - t2)
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        self.samples.append((rtt, offset))
+        self.rtt, self.offset = min(self.samples)
+        self.count += 1
+
+    def master_time(self, local_time=None):
+        return (time.time() if local_time is None else local_time) + self.offset
+
+    def snapshot(self):
+        return {"offset": self.offset, "rtt": self.rtt, "samples": self.count}
+
+
 def parse_args():
     par = argparse.ArgumentParser()
     par.add_argument("--host", default=False, action="store_true", help="run as host node.")
+    par.add_argument("--loopback", default=False, action="store_true",
+                     help="run server and client on this machine and measure command latency.")
+    par.add_argument("--loss", default=0.0, type=float, help="simulated packet loss rate in loopback mode.")
+    par.add_argument("-n", "--count", default=200, type=int, help="number of commands sent in loopback mode.")
     par.add_argument("-p", "--port", default=30728, type=int)
 
     par.add_argument("-b", "--broadcast-addr", default="10.12.41.255", help="broadcast address")
+    par.add_argument("--sync-retries", default=5, type=int, help="max retransmissions of a sync command.")
+    par.add_argument("--sync-retry-interval", default=0.02, type=float,
+                     help="seconds between retransmissions of an unacknowledged sync command.")
+    par.add_argument("--clock-interval", default=1.0, type=float,
+                     help="seconds between clock offset measurements of a client.")
+    par.add_argument("--status-interval", default=1.0, type=float,
+                     help="seconds between status reports of a client to the master.")
 
     args = par.parse_args()
     return args
 
 
+class PendingCommand:
+    def __init__(self, seq, data):
+        self.seq = seq
+        self.data = data
+        self.sent = time.time()
+        self.next_retry = self.sent
+        self.retries = 0
+        self.acked = set()
+
+
 class SyncServer:
 
     def __init__(self, args):
         self.args = args
+
+        self.pid = 0  # person id
+        self.aid = 0  # action id
+        self.sid = 0  # shot id
+
+        self.session = struct.unpack("<I", os.urandom(4))[0]
+        self.seq = 0
+        self.clients = set()
+        self.clocks = {}
+        self.stations = {}
+        self.last_beacon = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.loss = getattr(args, "loss", 0.0)
+        self.open()
+
+    def open(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
 
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -42,11 +200,21 @@ class SyncServer:
         self.sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING,
                              SOF_TIMESTAMPING_RX_HARDWARE | SOF_TIMESTAMPING_TX_HARDWARE | SOF_TIMESTAMPING_RAW_HARDWARE)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.sock.bind(("0.0.0.0", self.args.port))
+        # commands go out from an ephemeral port, so acks reach the server even when a client runs on this machine
+        self.sock.bind(("0.0.0.0", 0))
+        self.sock.settimeout(min(0.1, self.args.sync_retry_interval))
 
-        self.pid = 0  # person id
-        self.aid = 0  # action id
-        self.sid = 0  # shot id
+        self.working = True
+        self.worker = threading.Thread(target=self.proc, daemon=True)
+        self.worker.start()
+
+    def close(self):
+        self.working = False
+        self.worker.join()
+        self.sock.close()
+
+    def sendto(self, data, address):
+        self.sock.sendto(data, address)
 
     def set_record(self, pid=None, aid=None, sid=None):
         self.pid = pid if pid is not None else self.pid
@@ -54,56 +222,139 @@ class SyncServer:
         self.sid = sid if sid is not None else self.sid
 
     def broadcast(self, data):
-        self.sock.sendto(json.dumps(data).encode("utf8"), (self.args.broadcast_addr, self.args.port))
+        self.sendto(data, (self.args.broadcast_addr, self.args.port))
+
+    def send_command(self, ctrl, at=0.0):
+        with self.lock:
+            self.seq += 1
+            data = pack_message(KIND_COMMAND, ctrl, self.session, self.seq, time.time(), self.aid, self.pid, self.sid,
+                                at=at)
+            self.pending[self.seq] = PendingCommand(self.seq, data)
+            self.pending[self.seq].next_retry += self.args.sync_retry_interval
+        self.broadcast(data)
+        return self.seq
+
+    def handle_ping(self, d, address, t2):
+        self.sendto(pack_clock(KIND_PONG, self.session, d["seq"], d["t1"], t2, time.time()), address)
+        if d["rtt"] <= 0:
+            return
+        with self.lock:
+            previous = self.clocks.get(address)
+            self.clocks[address] = {"offset": d["offset"], "rtt": d["rtt"], "updated": time.time()}
+        if previous is None or abs(previous["offset"] - d["offset"]) > 0.001:
+            print("Sync client {}: clock offset {:+.3f} ms, rtt {:.3f} ms".format(
+                address, d["offset"] * 1000, d["rtt"] * 1000))
+
+    def clock_table(self):
+        with self.lock:
+            return dict(self.clocks)
+
+    def station_table(self):
+        # {address: latest status of the client station}
+        with self.lock:
+            return {address: dict(status) for address, status in self.stations.items()}
+
+    def handle_message(self, raw, address, t2):
+        if self.loss > 0 and random.random() < self.loss:
+            return
+        try:
+            d = unpack_message(raw)
+        except ValueError:
+            return
+        if d["kind"] == KIND_PING:
+            self.handle_ping(d, address, t2)
+            return
+        if d["kind"] == KIND_STATUS:
+            d["updated"] = time.time()
+            with self.lock:
+                self.stations[address] = d
+            return
+        if d["kind"] != KIND_ACK or d["session"] != self.session:
+            return
+        with self.lock:
+            if address not in self.clients:
+                print("Sync client joined:", address)
+                self.clients.add(address)
+            pending = self.pending.get(d["seq"])
+            if pending is not None:
+                pending.acked.add(address)
+
+    def retransmit(self):
+        now = time.time()
+        with self.lock:
+            for seq in list(self.pending):
+                pending = self.pending[seq]
+                if len(self.clients) > 0 and self.clients <= pending.acked:
+                    del self.pending[seq]
+                    continue
+                if now < pending.next_retry:
+                    continue
+                if pending.retries >= self.args.sync_retries:
+                    missing = self.clients - pending.acked
+                    if len(missing) > 0:
+                        print("[WARN] sync command {} was not acknowledged by {}".format(seq, sorted(missing)))
+                    del self.pending[seq]
+                    continue
+                pending.retries += 1
+                pending.next_retry = now + self.args.sync_retry_interval
+                self.broadcast(pending.data)
+
+    def beacon(self):
+        # lets clients find the master before the first command, so they can measure their clock offset
+        now = time.time()
+        if now - self.last_beacon >= self.args.clock_interval:
+            self.last_beacon = now
+            self.broadcast(pack_message(KIND_BEACON, 0, self.session, 0, now, self.aid, self.pid, self.sid))
+
+    def proc(self):
+        while self.working:
+            try:
+                raw, ancdata, flags, address = self.sock.recvmsg(65535, 1024)
+                self.handle_message(raw, address, rx_timestamp(ancdata) or time.time())
+            except socket.timeout:
+                pass
+            except OSError:
+                if not self.working:
+                    break
+                raise
+            self.retransmit()
+            self.beacon()
+
+    def is_acknowledged(self, seq):
+        with self.lock:
+            return seq not in self.pending
 
     def notify_update(self):
-        d = {
-            "t": time.time(),
-            "ctrl": "update",
-            "aid": self.aid,
-            "pid": self.pid,
-            "sid": self.sid,
-        }
-
-        self.broadcast(d)
-
-    def notify_start(self):
-        d = {
-            "t": time.time(),
-            "ctrl": "record",
-            "aid": self.aid,
-            "pid": self.pid,
-            "sid": self.sid,
-        }
-
-        self.broadcast(d)
+        return self.send_command(CTRL_UPDATE)
 
-    def notify_stop(self):
-        d = {
-            "t": time.time(),
-            "ctrl": "stop",
-            "aid": self.aid,
-            "pid": self.pid,
-            "sid": self.sid,
-        }
-
-        self.broadcast(d)
+    def notify_start(self, at=0.0):
+        return self.send_command(CTRL_RECORD, at)
 
-    def notify_cancel(self):
-        d = {
-            "t": time.time(),
-            "ctrl": "cancel",
-            "aid": self.aid,
-            "pid": self.pid,
-            "sid": self.sid,
-        }
+    def notify_stop(self, at=0.0):
+        return self.send_command(CTRL_STOP, at)
 
-        self.broadcast(d)
+    def notify_cancel(self, at=0.0):
+        return self.send_command(CTRL_CANCEL, at)
 
 
 class SyncClient:
     def __init__(self, args):
         self.args = args
+        self.host = None
+        self.loss = getattr(args, "loss", 0.0)
+        # highest command seq dispatched per server session, commands are applied in order or not at all
+        self.applied = {}
+        self.duplicates = 0
+        self.stale = 0
+        self.clock = ClockEstimator()
+        self.ping_seq = 0
+        self.last_ping = 0
+        self.status_provider = None
+        self.status_seq = 0
+        self.last_status = 0
+        self.open()
+
+    def open(self):
         self.conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
 
         self.conn.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
@@ -113,13 +364,86 @@ class SyncClient:
         self.conn.settimeout(0.1)
         self.conn.bind(("0.0.0.0", self.args.port))
 
-        self.host = None
+    def start(self):
+        # commands are polled with `wait`
+        pass
+
+    def close(self):
+        self.conn.close()
+
+    def sendto(self, data, address):
+        self.conn.sendto(data, address)
+
+    def acknowledge(self, d, address):
+        self.sendto(pack_message(KIND_ACK, 0, d["session"], d["seq"], time.time(), 0, 0, 0), address)
+
+    def ping(self):
+        now = time.time()
+        if self.host is None or now - self.last_ping < self.args.clock_interval:
+            return
+        self.last_ping = now
+        self.ping_seq += 1
+        self.sendto(pack_clock(KIND_PING, 0, self.ping_seq, time.time(), offset=self.clock.offset,
+                                    rtt=self.clock.rtt if self.clock.count > 0 else 0.0), self.host)
+
+    def report_status(self):
+        now = time.time()
+        if self.host is None or self.status_provider is None or now - self.last_status < self.args.status_interval:
+            return
+        self.last_status = now
+        self.status_seq += 1
+        self.sendto(pack_status(self.status_seq, self.status_provider()), self.host)
+
+    def handle_datagram(self, raw_data, address, rx_time):
+        # returns the command to dispatch, None for acks, clock, duplicate and stale messages
+        if self.loss > 0 and random.random() < self.loss:
+            return None
+
+        try:
+            d = unpack_message(raw_data)
+        except ValueError as e:
+            print("IGN:", e)
+            return None
+
+        if d["kind"] == KIND_PONG:
+            if self.host is not None and address == self.host:
+                self.clock.add(d["t1"], d["t2"], d["t3"], rx_time)
+            return None
+        if d["kind"] == KIND_BEACON:
+            if self.host is None or self.host[0] == address[0]:
+                if self.host is None:
+                    print("Now receiving sync signal from", address)
+                self.host = address
+            return None
+        if d["kind"] != KIND_COMMAND:
+            return None
+
+        if self.host is not None and self.host[0] != address[0]:
+            return None
+        if self.host is None:
+            print("Now receiving sync signal from", address)
+        self.host = address
+
+        # a retransmission that arrives after a newer command is acked so the server stops resending it, but a
+        # record that arrives after its stop must not start a take nobody stops
+        self.acknowledge(d, address)
+        applied = self.applied.get(d["session"], 0)
+        if d["seq"] <= applied:
+            if d["seq"] == applied:
+                self.duplicates += 1
+            else:
+                self.stale += 1
+            return None
+        self.applied[d["session"]] = d["seq"]
+        return d
 
     def wait(self, timeout=None):
         enter_time = time.time()
         last_time = enter_time
 
         while timeout is None or last_time - enter_time < timeout:
+            self.ping()
+            self.report_status()
             try:
                 raw_data, ancdata, flags, address = self.conn.recvmsg(65535, 1024)
             except socket.timeout:
@@ -127,33 +451,12 @@ class SyncClient:
                 continue
 
             client_side_ts = time.time()
-            timestamp = 0
+            last_time = client_side_ts
+            timestamp = rx_timestamp(ancdata)
 
-            if len(ancdata) > 0:
-
-                for i in ancdata:
-                    cmsg_level, cmsg_type, cmsg_data = i
-                    if cmsg_level != socket.SOL_SOCKET:
-                        continue
-
-                    if cmsg_type == SO_TIMESTAMPNS:
-                        tmp = (struct.unpack("iiii", i[2]))
-                        timestamp = tmp[0] + tmp[2] * 1e-9
-                        print("SCM_TIMESTAMPNS,", tmp, ", timestamp =", timestamp)
-                        break
-
-            if self.host is None or self.host == address:
-                if self.host is None:
-                    self.host = address
-                    print("Now receiving sync signal from", self.host)
-
-                try:
-                    d = json.loads(raw_data.decode("utf8"))
-                    return d, {"nic-rx": timestamp, "client": client_side_ts}
-                except json.JSONDecodeError:
-                    print("IGN: (str)", raw_data.decode("utf8"))
-                except UnicodeDecodeError:
-                    print("IGN: (raw)", raw_data.decode("utf8"))
+            d = self.handle_datagram(raw_data, address, timestamp or client_side_ts)
+            if d is not None:
+                return d, {"nic-rx": timestamp, "client": client_side_ts}
 
         raise socket.timeout
 
@@ -181,9 +484,55 @@ def proc_client(args):
         print(c.wait())
 
 
+def proc_loopback(args):
+    c = SyncClient(args)
+    s = SyncServer(args)
+    received = {}
+
+    def receive():
+        while True:
+            try:
+                d, ts = c.wait(timeout=1)
+            except socket.timeout:
+                break
+            received[d["seq"]] = ts["client"] - d["t"]
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+
+    sent = {}
+    for _ in range(args.count):
+        seq = s.notify_start()
+        sent[seq] = time.time()
+        while not s.is_acknowledged(seq):
+            time.sleep(0.001)
+        sent[seq] = time.time() - sent[seq]
+    receiver.join()
+    s.close()
+    c.close()
+
+    latency = sorted(received.values())
+    acked = sorted(sent.values())
+
+    def percentile(values, p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1000 if len(values) > 0 else float("nan")
+
+    print("loss rate {:.0%}: {} of {} commands delivered, {} duplicates and {} stale commands suppressed".format(
+        args.loss, len(received), args.count, c.duplicates, c.stale))
+    print("delivery latency p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms".format(
+        percentile(latency, 0.5), percentile(latency, 0.99), percentile(latency, 1.0)))
+    print("clock offset {:+.3f} ms, rtt {:.3f} ms over {} exchanges".format(
+        c.clock.offset * 1000, c.clock.rtt * 1000, c.clock.count))
+    print("ack round trip   p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms".format(
+        percentile(acked, 0.5), percentile(acked, 0.99), percentile(acked, 1.0)))
+
+
 def main():
     args = parse_args()
-    if args.host:
+    if args.loopback:
+        print("loopback mode")
+        proc_loopback(args)
+    elif args.host:
         print("server mode")
         proc_server(args)
     else:
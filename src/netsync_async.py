@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import ipaddress
+import socket
+import struct
+import threading
+import time
+
+import netsync
+
+
+def parse_groups(args):
+    # [(address, port)] of every broadcast / multicast group the sync runs on, "addr[:port]" comma separated
+    groups = []
+    for group in (args.sync_groups or args.broadcast_addr).split(","):
+        address, _, port = group.strip().partition(":")
+        groups.append((address, int(port) if port else args.port))
+    return groups
+
+
+def is_multicast(address):
+    return ipaddress.ip_address(address).is_multicast
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, on_datagram):
+        self.on_datagram = on_datagram
+
+    def datagram_received(self, data, addr):
+        self.on_datagram(data, addr, time.time())
+
+
+class EventLoopThread:
+    # runs an asyncio loop on a daemon thread, `call` runs a function on it from any thread
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.worker = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.worker.start()
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def call(self, f, *args):
+        if threading.current_thread() is self.worker:
+            f(*args)
+        else:
+            self.loop.call_soon_threadsafe(f, *args)
+
+    def every(self, interval, f):
+        def tick():
+            f()
+            self.loop.call_later(interval, tick)
+
+        self.loop.call_soon_threadsafe(tick)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.worker.join()
+        self.loop.close()
+
+
+class AsyncSyncServer(netsync.SyncServer):
+    # same protocol as netsync.SyncServer, acks / pings / status are handled as they arrive on an asyncio loop and
+    # commands are sent to every sync group
+
+    def open(self):
+        self.groups = parse_groups(self.args)
+        self.events = EventLoopThread()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.bind(("0.0.0.0", 0))
+        sock.setblocking(False)
+
+        async def create():
+            transport, _ = await self.events.loop.create_datagram_endpoint(
+                lambda: DatagramProtocol(self.handle_message), sock=sock)
+            return transport
+
+        self.transport = self.events.run(create())
+        self.events.every(min(self.args.sync_retry_interval, self.args.clock_interval), self.tick)
+
+    def tick(self):
+        self.retransmit()
+        self.beacon()
+
+    def close(self):
+        self.events.call(self.transport.close)
+        self.events.close()
+
+    def sendto(self, data, address):
+        self.events.call(self.transport.sendto, data, address)
+
+    def broadcast(self, data):
+        for group in self.groups:
+            self.sendto(data, group)
+
+
+class AsyncSyncClient(netsync.SyncClient):
+    # same protocol as netsync.SyncClient, but commands are passed to `on_command(command)` on the asyncio loop
+    # as soon as they arrive instead of being polled with `wait`. groups sharing a port share one socket.
+    # the sockets are opened by `start`, datagrams sent before are neither acked nor dispatched, so the server
+    # retransmits them.
+
+    def __init__(self, args, on_command):
+        self.on_command = on_command
+        super(AsyncSyncClient, self).__init__(args)
+
+    def open(self):
+        self.events = EventLoopThread()
+        self.transports = []
+
+    def start(self):
+        if len(self.transports) > 0:
+            return
+        ports = {}
+        for address, port in parse_groups(self.args):
+            ports.setdefault(port, []).append(address)
+
+        for port, addresses in ports.items():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(("0.0.0.0", port))
+            for address in addresses:
+                if is_multicast(address):
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                    struct.pack("4s4s", socket.inet_aton(address), socket.inet_aton("0.0.0.0")))
+            sock.setblocking(False)
+
+            async def create(sock=sock):
+                transport, _ = await self.events.loop.create_datagram_endpoint(
+                    lambda: DatagramProtocol(self.handle_received), sock=sock)
+                return transport
+
+            self.transports.append(self.events.run(create()))
+
+        self.events.every(min(self.args.clock_interval, self.args.status_interval) / 2, self.tick)
+
+    def tick(self):
+        self.ping()
+        self.report_status()
+
+    def handle_received(self, raw_data, address, rx_time):
+        d = self.handle_datagram(raw_data, address, rx_time)
+        if d is not None:
+            self.on_command(d)
+
+    def close(self):
+        for transport in self.transports:
+            self.events.call(transport.close)
+        self.events.close()
+
+    def sendto(self, data, address):
+        self.events.call(self.transports[0].sendto, data, address)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if len(values) > 0 else float("nan")
+
+
+def benchmark_threaded(args):
+    received = []
+    c = netsync.SyncClient(args)
+    s = netsync.SyncServer(args)
+
+    def receive():
+        while True:
+            try:
+                d, ts = c.wait(timeout=0.1)
+            except socket.timeout:
+                if len(received) >= args.count:
+                    break
+                continue
+            # dispatch time as seen by RecorderController.listen_for_sync
+            received.append(time.time() - d["t"])
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    for _ in range(args.count):
+        s.notify_update()
+        time.sleep(args.gap)
+    receiver.join(timeout=5 + args.count * args.gap)
+    s.close()
+    c.close()
+    return received
+
+
+def benchmark_asyncio(args):
+    received = []
+    c = AsyncSyncClient(args, lambda d: received.append(time.time() - d["t"]))
+    c.start()
+    s = AsyncSyncServer(args)
+    for _ in range(args.count):
+        s.notify_update()
+        time.sleep(args.gap)
+    time.sleep(0.2)
+    s.close()
+    c.close()
+    return received
+
+
+def main():
+    par = argparse.ArgumentParser("loopback dispatch latency benchmark of the sync engines")
+    par.add_argument("-p", "--port", default=30999, type=int)
+    par.add_argument("-b", "--broadcast-addr", default="127.255.255.255")
+    par.add_argument("--sync-groups", default=None, help="comma separated addr[:port] groups, defaults to -b.")
+    par.add_argument("-n", "--count", default=500, type=int, help="number of commands per engine.")
+    par.add_argument("--gap", default=0.005, type=float, help="seconds between commands.")
+    par.add_argument("--sync-retries", default=5, type=int)
+    par.add_argument("--sync-retry-interval", default=0.02, type=float)
+    par.add_argument("--clock-interval", default=1.0, type=float)
+    par.add_argument("--status-interval", default=1.0, type=float)
+    args = par.parse_args()
+
+    for name, f in (("threaded", benchmark_threaded), ("asyncio", benchmark_asyncio)):
+        latency = f(args)
+        print("{:<8} {} of {} dispatched, latency p50 {:.3f} ms, p90 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms".format(
+            name, len(latency), args.count, percentile(latency, 0.5), percentile(latency, 0.9),
+            percentile(latency, 0.99), percentile(latency, 1.0)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import threading
+
+# per take sha256 of every file in <take>/checksums.sha256, in the format of sha256sum, so `sha256sum -c` checks a
+# take as well. frames and depth files are hashed while they are written, event recordings while the sdk appends to
+# them. their digests are collected in `registry` by absolute path until the take is finalized, other files (json,
+# indexes, the color video opencv writes) are read back once when the checksum file is written.
+
+CHECKSUM_NAME = "checksums.sha256"
+CHUNK_SIZE = 1024 * 1024
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class HashingFile:
+    # write only file that hashes everything written to it, for writers that stream into a file front to back
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        registry.record(self.path, self.hash.hexdigest())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ChecksumRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.digests = {}
+
+    def record(self, path, hex_digest):
+        with self.lock:
+            self.digests[os.path.normpath(os.path.abspath(path))] = hex_digest
+
+    def move(self, old_path, new_path):
+        # a file or directory was renamed
+        old_path = os.path.normpath(os.path.abspath(old_path))
+        new_path = os.path.normpath(os.path.abspath(new_path))
+        with self.lock:
+            for path in [p for p in self.digests if p == old_path or p.startswith(old_path + os.sep)]:
+                self.digests[new_path + path[len(old_path):]] = self.digests.pop(path)
+
+    def pop(self, root):
+        # {path relative to root: digest} of the files recorded under root, they are forgotten
+        root = os.path.normpath(os.path.abspath(root))
+        with self.lock:
+            paths = [p for p in self.digests if p.startswith(root + os.sep)]
+            return {os.path.relpath(p, root): self.digests.pop(p) for p in paths}
+
+    def discard(self, root):
+        self.pop(root)
+
+
+registry = ChecksumRegistry()
+
+
+class AppendedFileHash:
+    # sha256 of a file another writer appends to, like the recording of a sensor sdk. `update` hashes what was
+    # appended since the last call while it is still in the page cache. the first `header_size` bytes are kept:
+    # `finish` reads them again once the writer closed the file, a writer that rewrote its header on close makes
+    # it hash the whole file again.
+
+    def __init__(self, path, header_size=4096):
+        self.path = path
+        self.header_size = header_size
+        self.header = b""
+        self.hash = hashlib.sha256()
+        self.file = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def update(self):
+        with self.lock:
+            if self.closed:
+                return
+            if self.file is None:
+                try:
+                    self.file = open(self.path, "rb")
+                except FileNotFoundError:
+                    return
+            while True:
+                chunk = self.file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(self.header) < self.header_size:
+                    self.header += chunk[:self.header_size - len(self.header)]
+                self.hash.update(chunk)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def finish(self):
+        # hex digest of the closed file
+        self.update()
+        self.close()
+        with open(self.path, "rb") as f:
+            header = f.read(len(self.header))
+        if header != self.header:
+            print("checksums: the header of {} changed after it was hashed, hashing it again".format(self.path))
+            return hash_file(self.path)
+        return self.hash.hexdigest()
+
+
+def hash_file(path, read_ahead=0, chunk_size=CHUNK_SIZE):
+    # reads into one reusable buffer, with `read_ahead` bytes the kernel is asked to prefetch ahead of the reader
+    h = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        offset = 0
+        while True:
+            if read_ahead > 0 and hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), offset + chunk_size, read_ahead, os.POSIX_FADV_WILLNEED)
+            n = f.readinto(buffer)
+            if not n:
+                break
+            h.update(view[:n])
+            offset += n
+    return h.hexdigest()
+
+
+def write_take_checksums(take_path):
+    # writer finalizer, register it after the finalizers that add files to the take
+    recorded = registry.pop(take_path)
+    lines = []
+    hashed = 0
+    for root, dirs, files in os.walk(take_path):
+        for name in files:
+            relpath = os.path.relpath(os.path.join(root, name), take_path)
+            if relpath == CHECKSUM_NAME:
+                continue
+            hex_digest = recorded.get(relpath)
+            if hex_digest is None:
+                hex_digest = hash_file(os.path.join(root, name))
+                hashed += 1
+            lines.append((relpath.replace(os.sep, "/"), hex_digest))
+    path = os.path.join(take_path, CHECKSUM_NAME)
+    with open(path + ".tmp", "w") as f:
+        for relpath, hex_digest in sorted(lines):
+            f.write("{}  {}\n".format(hex_digest, relpath))
+    os.replace(path + ".tmp", path)
+    print("checksums: {} files of {}, {} hashed while writing".format(len(lines), take_path, len(lines) - hashed))
+
+
+def load_take_checksums(take_path):
+    # {relative path: digest}, None when the take has no checksum file
+    try:
+        with open(os.path.join(take_path, CHECKSUM_NAME)) as f:
+            lines = [line.rstrip("\n").split("  ", 1) for line in f if line.strip()]
+    except FileNotFoundError:
+        return None
+    return {relpath: hex_digest for hex_digest, relpath in lines}
@@ -0,0 +1,123 @@
+import json
+import os
+import time
+
+import cv2
+
+from reader import metrics
+
+# one lossless FFV1 video per take instead of a PNG per color frame. FFV1 only has intra frames and opencv encodes
+# bgr8 input as bgr0, so every frame decodes bit exact and any frame can be decoded on its own.
+# color.json next to the video holds the frame count, which opencv can only estimate from the container.
+
+VIDEO_NAME = "color.mkv"
+INFO_NAME = "color.json"
+FOURCC = "FFV1"
+
+
+class ColorVideoError(Exception):
+    pass
+
+
+class ColorVideoWriter:
+    def __init__(self, modal_path, fps=60):
+        self.path = os.path.join(modal_path, VIDEO_NAME)
+        self.info_path = os.path.join(modal_path, INFO_NAME)
+        self.fps = fps
+        self.writer = None
+        self.shape = None
+        self.count = 0
+
+    def append(self, frame):
+        if self.writer is None:
+            self.shape = frame.shape
+            self.writer = cv2.VideoWriter(self.path, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*FOURCC), self.fps,
+                                          (frame.shape[1], frame.shape[0]))
+            if not self.writer.isOpened():
+                raise ColorVideoError("failed to open {} for writing with {}".format(self.path, FOURCC))
+        elif frame.shape != self.shape:
+            raise ColorVideoError("frame shape {} does not match {}".format(frame.shape, self.shape))
+        encode_start = time.perf_counter()
+        self.writer.write(frame)
+        metrics.observe("encode", time.perf_counter() - encode_start)
+        self.count += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+        height, width = self.shape[:2] if self.shape is not None else (0, 0)
+        with open(self.info_path, "w") as f:
+            json.dump({"frames": self.count, "fps": self.fps, "codec": FOURCC, "width": width, "height": height},
+                      f, indent=2)
+
+
+class ColorVideoReader:
+    # frame accurate random access into a take's color video. reading on from the last frame decodes straight
+    # through, short jumps forward grab the frames in between and longer jumps seek, checking that the backend
+    # landed on the requested frame and decoding forward from the start if it didn't.
+
+    def __init__(self, modal_path, forward_limit=30):
+        self.path = os.path.join(modal_path, VIDEO_NAME)
+        with open(os.path.join(modal_path, INFO_NAME)) as f:
+            self.info = json.load(f)
+        self.forward_limit = forward_limit
+        self.capture = None
+        self.position = 0
+
+    def __len__(self):
+        return self.info["frames"]
+
+    def open(self):
+        self.close()
+        self.capture = cv2.VideoCapture(self.path, cv2.CAP_FFMPEG)
+        if not self.capture.isOpened():
+            raise ColorVideoError("failed to open {}".format(self.path))
+        self.position = 0
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def grab(self, n):
+        for _ in range(n):
+            if not self.capture.grab():
+                raise ColorVideoError("{} ended at frame {}".format(self.path, self.position))
+            self.position += 1
+
+    def seek(self, i):
+        if self.capture is None:
+            self.open()
+        if i == self.position:
+            return
+        if 0 < i - self.position <= self.forward_limit:
+            self.grab(i - self.position)
+            return
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, i)
+        if int(self.capture.get(cv2.CAP_PROP_POS_FRAMES)) == i:
+            self.position = i
+            return
+        self.open()
+        self.grab(i)
+
+    def read(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError("frame {} out of range of {} frames".format(i, len(self)))
+        self.seek(i)
+        ok, frame = self.capture.read()
+        if not ok:
+            raise ColorVideoError("failed to decode frame {} of {}".format(i, self.path))
+        self.position += 1
+        return frame
+
+    def read_many(self, indices):
+        # decodes in file order, returns the frames in the order of `indices`
+        frames = {i: self.read(i) for i in sorted(set(indices))}
+        return [frames[i] for i in indices]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
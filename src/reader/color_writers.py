@@ -0,0 +1,62 @@
+import os
+
+import cv2
+
+from reader.color_video import INFO_NAME, ColorVideoReader, ColorVideoWriter
+
+
+class PngColorWriter:
+    def __init__(self, modal_path, encoder):
+        self.modal_path = modal_path
+        self.encode_job = encoder.job(modal_path)
+        self.count = 0
+
+    def append(self, frame):
+        self.encode_job.submit(os.path.join(self.modal_path, "{:06d}.png".format(self.count)), frame)
+        self.count += 1
+
+    def close(self):
+        self.encode_job.close()
+
+
+class PngColorReader:
+    def __init__(self, modal_path):
+        self.modal_path = modal_path
+        self.names = sorted(x for x in os.listdir(modal_path) if x.endswith(".png"))
+
+    def __len__(self):
+        return len(self.names)
+
+    def read(self, i):
+        return cv2.imread(os.path.join(self.modal_path, self.names[i]), cv2.IMREAD_UNCHANGED)
+
+    def read_many(self, indices):
+        return [self.read(i) for i in indices]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_color_writer(color_format, modal_path, encoder, fps=60):
+    if color_format == "video":
+        return ColorVideoWriter(modal_path, fps)
+    return PngColorWriter(modal_path, encoder)
+
+
+def detect_color_format(modal_path):
+    if os.path.exists(os.path.join(modal_path, INFO_NAME)):
+        return "video"
+    return "png"
+
+
+def open_color_reader(modal_path):
+    # random access to the color frames of a take in any format: len(reader), reader.read(i), reader.read_many(ids)
+    if detect_color_format(modal_path) == "video":
+        return ColorVideoReader(modal_path)
+    return PngColorReader(modal_path)
@@ -0,0 +1,69 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+from reader.frame_index import load_frame_index
+
+# the event camera SDK doesn't expose event timestamps while recording, so EventReader samples the size of the
+# recording file against the host clock. together with the host arrival time of every realsense frame this gives,
+# for color frame i, the byte range of the event file that holds the events between frame i and frame i + 1.
+# ranges are conservative: they start at the last sample before frame i and end at the first sample after
+# frame i + 1 plus `slack` seconds of write latency, the decoder still filters events by timestamp.
+
+TIMELINE_DTYPE = np.dtype([("host_time", "<f8"), ("byte_offset", "<i8")])
+TIMELINE_NAME = "event_timeline.npy"
+ANCHORS_NAME = "event_anchors.json"
+REALSENSE_INDEX_NAME = "realsense.cfi"
+CROSS_INDEX_NAME = "color_event_index.npy"
+
+
+def write_event_timeline(modal_path, samples, anchors):
+    np.save(os.path.join(modal_path, TIMELINE_NAME), np.asarray(samples, dtype=TIMELINE_DTYPE))
+    with open(os.path.join(modal_path, ANCHORS_NAME), "w") as f:
+        json.dump(anchors, f, indent=2)
+
+
+def build_cross_index(take_path, slack=0.05, fps=60):
+    index_path = os.path.join(take_path, "frame_index")
+    if not os.path.exists(os.path.join(index_path, REALSENSE_INDEX_NAME)) or \
+            not os.path.exists(os.path.join(index_path, TIMELINE_NAME)):
+        return None
+
+    host_time = load_frame_index(os.path.join(index_path, REALSENSE_INDEX_NAME), ["host_time"])["host_time"]
+    timeline = np.load(os.path.join(index_path, TIMELINE_NAME))
+    if len(timeline) == 0:
+        return None
+
+    if len(host_time) == 0:
+        cross_index = np.empty((0, 2), dtype=np.int64)
+        np.save(os.path.join(index_path, CROSS_INDEX_NAME), cross_index)
+        return cross_index
+
+    # the last frame lasts one frame period, the nominal one when the take has a single frame
+    frame_period = np.median(np.diff(host_time)) if len(host_time) > 1 else 1.0 / fps
+    frame_start = host_time
+    frame_end = np.append(host_time[1:], host_time[-1] + frame_period)
+    first = np.clip(np.searchsorted(timeline["host_time"], frame_start, side="right") - 1, 0, len(timeline) - 1)
+    last = np.clip(np.searchsorted(timeline["host_time"], frame_end + slack, side="left"), 0, len(timeline) - 1)
+
+    cross_index = np.stack([timeline["byte_offset"][first], timeline["byte_offset"][last]], axis=1)
+    np.save(os.path.join(index_path, CROSS_INDEX_NAME), cross_index)
+    return cross_index
+
+
+def load_cross_index(take_path):
+    # (frame_count, 2) int64 of [start, end) byte offsets into the event file, memory mapped
+    return np.load(os.path.join(take_path, "frame_index", CROSS_INDEX_NAME), mmap_mode="r")
+
+
+def read_event_slice(take_path, frame, cross_index=None):
+    # raw bytes of the event file recorded between color frame `frame` and `frame + 1`
+    if cross_index is None:
+        cross_index = load_cross_index(take_path)
+    start, end = cross_index[frame]
+    event_file = glob.glob(os.path.join(take_path, "event", "*.bin"))[0]
+    with open(event_file, "rb") as f:
+        f.seek(int(start))
+        return f.read(int(end - start))
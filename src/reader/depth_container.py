@@ -0,0 +1,103 @@
+import os
+import struct
+
+import numpy as np
+
+from reader.checksums import HashingFile
+
+# single file per take holding every depth frame of the take as one contiguous uint16 array:
+#
+#   frames      frame_count * height * width uint16, little endian, C order
+#   timestamps  frame_count float64, milliseconds
+#   trailer     HEADER_SIZE bytes, see HEADER_FORMAT
+#
+# the container is written front to back and hashed while it is written. the timestamps and the trailer are written
+# on close, a container that has not been closed can't be read. version 1 containers have the header at the start.
+
+MAGIC = b"CDEPTH\x00\x00"
+VERSION = 2
+HEADER_FORMAT = "<8sIIIIQQ"
+HEADER_SIZE = 64
+FRAME_DTYPE = np.dtype("<u2")
+
+
+class DepthContainerError(Exception):
+    pass
+
+
+class DepthContainerWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = HashingFile(path)
+        self.shape = None
+        self.timestamps = []
+
+    def append(self, frame, timestamp=float("nan")):
+        if self.shape is None:
+            self.shape = frame.shape
+        elif frame.shape != self.shape:
+            raise DepthContainerError("frame shape {} does not match {}".format(frame.shape, self.shape))
+        self.file.write(memoryview(np.ascontiguousarray(frame, dtype=FRAME_DTYPE)).cast("B"))
+        self.timestamps.append(timestamp)
+
+    def close(self):
+        if self.file is None:
+            return
+        height, width = self.shape if self.shape is not None else (0, 0)
+        timestamps_offset = self.file.tell()
+        self.file.write(np.asarray(self.timestamps, dtype="<f8").tobytes())
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, height, width, len(self.timestamps),
+                                    0, timestamps_offset).ljust(HEADER_SIZE, b"\x00"))
+        self.file.close()
+        self.file = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def write_offsets(self):
+        # byte offset of every frame in the file
+        frame_bytes = int(np.prod(self.shape)) * FRAME_DTYPE.itemsize if self.shape is not None else 0
+        return [i * frame_bytes for i in range(len(self.timestamps))]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size < HEADER_SIZE:
+            raise DepthContainerError("{} is truncated".format(path))
+        f.seek(size - HEADER_SIZE)
+        raw = f.read(struct.calcsize(HEADER_FORMAT))
+        if not raw.startswith(MAGIC):
+            f.seek(0)
+            raw = f.read(struct.calcsize(HEADER_FORMAT))
+    magic, version, height, width, frame_count, data_offset, timestamps_offset = struct.unpack(HEADER_FORMAT, raw)
+    if magic != MAGIC:
+        raise DepthContainerError("{} is not a depth container or was not closed".format(path))
+    if version not in (1, VERSION):
+        raise DepthContainerError("{} has unsupported version {}".format(path, version))
+    return {
+        "height": height,
+        "width": width,
+        "frame_count": frame_count,
+        "data_offset": data_offset,
+        "timestamps_offset": timestamps_offset,
+    }
+
+
+def load_depth_container(path):
+    # returns (frames, timestamps), frames is a read only np.memmap of shape (frame_count, height, width),
+    # indexing it only reads the requested frames from disk.
+    header = read_header(path)
+    frame_count = header["frame_count"]
+    if frame_count == 0:
+        return np.zeros((0, header["height"], header["width"]), dtype=FRAME_DTYPE), np.zeros(0, dtype="<f8")
+    frames = np.memmap(path, dtype=FRAME_DTYPE, mode="r", offset=header["data_offset"],
+                       shape=(frame_count, header["height"], header["width"]))
+    timestamps = np.fromfile(path, dtype="<f8", count=frame_count, offset=header["timestamps_offset"])
+    return frames, timestamps
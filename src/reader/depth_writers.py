@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+
+from reader.checksums import HashingFile
+from reader.depth_codec import DepthCodecWriter, load_depth_codec
+from reader.depth_container import DepthContainerWriter, load_depth_container
+
+CONTAINER_NAME = "depth_raw.cdepth"
+COMPRESSED_NAME = "depth_raw.cdz"
+
+
+class NpyDepthWriter:
+    def __init__(self, modal_path):
+        self.modal_path = modal_path
+        self.count = 0
+
+    def append(self, frame, timestamp=float("nan")):
+        with HashingFile(os.path.join(self.modal_path, "{:06d}.npy".format(self.count))) as f:
+            np.save(f, frame)
+        self.count += 1
+
+    def close(self):
+        pass
+
+    def write_offsets(self):
+        # the file number of every frame
+        return list(range(self.count))
+
+
+def open_depth_writer(depth_format, modal_path):
+    if depth_format == "container":
+        return DepthContainerWriter(os.path.join(modal_path, CONTAINER_NAME))
+    if depth_format == "compressed":
+        return DepthCodecWriter(os.path.join(modal_path, COMPRESSED_NAME))
+    return NpyDepthWriter(modal_path)
+
+
+def detect_depth_format(modal_path):
+    if os.path.exists(os.path.join(modal_path, CONTAINER_NAME)):
+        return "container"
+    if os.path.exists(os.path.join(modal_path, COMPRESSED_NAME)):
+        return "compressed"
+    return "npy"
+
+
+def load_depth_frames(modal_path):
+    # returns (frames, timestamps) of a depth_raw folder in any format, timestamps are nan when not recorded
+    depth_format = detect_depth_format(modal_path)
+    if depth_format == "container":
+        return load_depth_container(os.path.join(modal_path, CONTAINER_NAME))
+    if depth_format == "compressed":
+        return load_depth_codec(os.path.join(modal_path, COMPRESSED_NAME))
+    names = sorted(x for x in os.listdir(modal_path) if x.endswith(".npy"))
+    frames = [np.load(os.path.join(modal_path, x)) for x in names]
+    return frames, np.full(len(frames), np.nan)
@@ -1,33 +1,16 @@
-import os
-import queue
-import shutil
-import time
-
 import PyCeleX5
-import cv2
-import numpy
-from PyQt5 import QtGui
 
-from reader.readable import Readable
-from reader.reader_callback import ReaderCallback
-from reader.runnable import Runnable
+from reader.event_stream_reader import EventStreamReader
 from recorder_controller import RecorderController
 
 
-def random_string(length: int):
-    return "".join("{:02x}".format(x) for x in os.urandom(length))
-
-
 class EventCameraError(Exception):
     pass
 
 
-class EventReader(Runnable, ReaderCallback, Readable):
+class EventReader(EventStreamReader):
 
     def __init__(self, args, controller: RecorderController):
-        super(EventReader, self).__init__(args)
-        self.controller = controller
-        self.queue = queue.Queue()
         try:
             self.device = PyCeleX5.PyCeleX5()
             self.device.openSensor(PyCeleX5.DeviceType.CeleX5_MIPI)
@@ -51,68 +34,16 @@ class EventReader(Runnable, ReaderCallback, Readable):
             # self.device.setSensorLoopMode(PyCeleX5.CeleX5Mode.Event_Off_Pixel_Timestamp_Mode, 3)
             # self.device.setLoopModeEnabled(True)
 
-            self.device.setFpnFile("/home/event/Desktop/record_dataset_net/FPN_lab.txt")
+            self.device.setFpnFile(args.fpn_file)
         except Exception:
             raise EventCameraError
-        self.window = None
-        self.current_record = None
-        self.is_recording = False
-        self.controller.register_reader(self)
+        super(EventReader, self).__init__(args, controller)
 
-    def register_window(self, window):
-        self.window = window
+    def start_recording(self, path):
+        self.device.startRecording(path)
 
-    def notify_record(self):
-        if self.is_recording:
-            print("EventReader: notified to recording, but it is recording already.")
-            return
-        print("EventReader: notified to recording")
-        self.current_record = os.path.join(self.args.path, ".event_stream.{}".format(random_string(5)))
-        self.is_recording = True
-        self.device.startRecording(self.current_record)
-
-    def notify_save(self, aid, pid):
-        if not self.is_recording:
-            print("EventReader: notified to saving, but it is not in recording mode.")
-            return
-        print("EventReader: notified to saving")
-        self.is_recording = False
+    def stop_recording(self):
         self.device.stopRecording()
-        self.queue.put(("event", self.save_data, (self.current_record,)))
-        self.current_record = None
-
-    def notify_cancel(self):
-        print("EventReader: notified to cancelling")
-        if not self.is_recording:
-            print("EventReader: notified to canceling, but it is not in recording mode.")
-            return
-        self.is_recording = False
-        self.device.stopRecording()
-        os.remove(self.current_record)
-        self.current_record = None
-
-    def proc(self):
-        while self.working:
-            if self.window and not self.is_recording:
-                img = self.device.getEventPicBuffer(PyCeleX5.EventPicType.EventDenoisedBinaryPic)
-                img = cv2.resize(img, (480, 300))
-                if self.args.layout == "portrait":
-                    img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
-                img = numpy.ascontiguousarray(img[:, ::-1])
-                img_show = QtGui.QImage(img.data, img.shape[1], img.shape[0], QtGui.QImage.Format_Grayscale8)
-                self.window.signal_event_snapshot.emit(img_show)
-            time.sleep(0.01)
-
-    def poll(self):
-        return self.queue.qsize() > 0
-
-    def read(self):
-        print("EventReader: returning job ...")
-        return [self.queue.get(block=False)]
 
-    def save_data(self, modal_path, modal_data):
-        print("EventReader: saving job ...", modal_path)
-        action = modal_path[-20:-15]
-        person = modal_path[-15:-10]
-        stream = modal_path[-9:-6]
-        shutil.move(modal_data[0], os.path.join(modal_path, "{}_{}_{}.bin".format(action, person, stream)))
+    def read_preview(self):
+        return self.device.getEventPicBuffer(PyCeleX5.EventPicType.EventDenoisedBinaryPic)
@@ -0,0 +1,154 @@
+import os
+import shutil
+import threading
+import time
+
+import cv2
+
+from reader import checksums, metrics
+from reader.cross_index import write_event_timeline
+from reader.preview import FramePreview
+from reader.profiling import profiler
+from reader.readable import Readable
+from reader.reader_callback import ReaderCallback
+from reader.runnable import Runnable
+from reader.utils import random_string
+from recorder_controller import RecorderController
+
+
+class EventStreamReader(Runnable, ReaderCallback, Readable):
+    # records an event camera into one .bin file per take, subclasses drive the sensor.
+
+    def __init__(self, args, controller: RecorderController):
+        super(EventStreamReader, self).__init__(args)
+        self.controller = controller
+        self.window = None
+        self.current_record = None
+        self.record_hash = None
+        self.timeline = []
+        # the proc thread samples the record while notify_save appends the last sample, samples stay in time order
+        self.timeline_lock = threading.Lock()
+        self.anchors = {}
+        self.is_recording = False
+        self.preview = FramePreview("event", args.preview_fps, (480, 300),
+                                    cv2.ROTATE_90_CLOCKWISE if args.layout == "portrait" else None, flip=True)
+        self.controller.register_reader(self)
+
+    def start_recording(self, path):
+        raise NotImplementedError
+
+    def stop_recording(self):
+        raise NotImplementedError
+
+    def read_preview(self):
+        # grayscale uint8 snapshot of the recent events
+        raise NotImplementedError
+
+    def register_window(self, window):
+        self.window = window
+        window.register_preview("event", self.preview)
+
+    def notify_record(self):
+        if self.is_recording:
+            print("EventReader: notified to recording, but it is recording already.")
+            return
+        print("EventReader: notified to recording")
+        self.current_record = os.path.join(self.args.path, ".event_stream.{}".format(random_string(5)))
+        self.record_hash = checksums.AppendedFileHash(self.current_record)
+        self.anchors = {"record_enter": time.time()}
+        self.start_recording(self.current_record)
+        self.anchors["record"] = time.time()
+        self.timeline = [(self.anchors["record"], 0)]
+        self.is_recording = True
+
+    def notify_save(self, aid, pid, sid):
+        if not self.is_recording:
+            print("EventReader: notified to saving, but it is not in recording mode.")
+            self.push((aid, pid, sid), [])
+            return
+        print("EventReader: notified to saving")
+        self.is_recording = False
+        self.anchors["save_enter"] = time.time()
+        self.stop_recording()
+        with self.timeline_lock:
+            self.anchors["save"] = time.time()
+            self.timeline.append((self.anchors["save"], os.path.getsize(self.current_record)))
+            current_record, record_hash = self.current_record, self.record_hash
+            self.current_record = None
+            self.record_hash = None
+        self.push((aid, pid, sid), [
+            ("event", self.save_data, (current_record, record_hash)),
+            ("frame_index", self.save_index, (self.timeline, self.anchors))
+        ])
+
+    def notify_cancel(self):
+        print("EventReader: notified to cancelling")
+        if not self.is_recording:
+            print("EventReader: notified to canceling, but it is not in recording mode.")
+            return
+        self.is_recording = False
+        self.stop_recording()
+        os.remove(self.current_record)
+        self.record_hash.close()
+        self.current_record = None
+        self.record_hash = None
+
+    def sample_record_size(self):
+        current_record, record_hash = self.current_record, self.record_hash
+        if current_record is None:
+            return
+        try:
+            with self.timeline_lock:
+                if self.current_record is not current_record:
+                    # saved since, the last sample is taken by notify_save
+                    return
+                self.timeline.append((time.time(), os.path.getsize(current_record)))
+            record_hash.update()
+        except OSError:
+            pass
+
+    def proc(self):
+        while self.working:
+            profiler.checkpoint()
+            if self.is_recording:
+                self.sample_record_size()
+            elif self.window and self.preview.due():
+                # the sensor only renders a picture when the preview needs one
+                self.preview.submit(self.read_preview())
+            time.sleep(0.01)
+
+    def describe_parts(self, parts):
+        if len(parts) == 0:
+            return []
+        timeline, anchors = parts[1][2]
+        return {"event": parts[0][2][0], "timeline": timeline, "anchors": anchors}
+
+    def restore_parts(self, description):
+        if len(description) == 0:
+            return []
+        return [
+            ("event", self.save_data, (description["event"], None)),
+            ("frame_index", self.save_index, ([tuple(x) for x in description["timeline"]], description["anchors"]))
+        ]
+
+    def save_index(self, modal_path, modal_data):
+        timeline, anchors = modal_data
+        print("EventReader: saving timeline, {} samples".format(len(timeline)))
+        write_event_timeline(modal_path, timeline, anchors)
+
+    def save_data(self, modal_path, modal_data):
+        print("EventReader: saving job ...", modal_path)
+        action = modal_path[-20:-15]
+        person = modal_path[-15:-10]
+        stream = modal_path[-9:-6]
+        target = os.path.join(modal_path, "{}_{}_{}.bin".format(action, person, stream))
+        if not os.path.exists(modal_data[0]) and os.path.exists(target):
+            # moved already by a write that was interrupted before its commit
+            return
+        # the rest of the record is hashed on the writer thread, a record restored after a restart is read again
+        record_hash = modal_data[1]
+        checksums.registry.record(target, record_hash.finish() if record_hash is not None
+                                  else checksums.hash_file(modal_data[0]))
+        move_start = time.perf_counter()
+        shutil.move(modal_data[0], target)
+        metrics.observe("move", time.perf_counter() - move_start)
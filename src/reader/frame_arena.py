@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+
+
+class FrameArena:
+    # stores equally shaped frames in preallocated contiguous blocks of `chunk_frames` frames each.
+    # `append` copies a frame into the next free slot, a new block is only allocated when all blocks are full,
+    # and `reset` keeps the blocks around so the next take reuses them.
+    # `spill` moves the frames into a read only memory mapped scratch file to free the blocks.
+    __slots__ = ("chunk_frames", "chunks", "count", "dtype", "frame_shape", "spill_path")
+
+    def __init__(self, chunk_frames):
+        self.chunk_frames = max(1, chunk_frames)
+        self.chunks = []
+        self.count = 0
+        self.dtype = None
+        self.frame_shape = None
+        self.spill_path = None
+
+    def append(self, frame):
+        if self.spill_path is not None:
+            raise ValueError("cannot append to a spilled arena")
+        if self.frame_shape is None or frame.shape != self.frame_shape or frame.dtype != self.dtype:
+            if self.count > 0:
+                raise ValueError("frame {} {} does not fit arena of {} {}".format(
+                    frame.shape, frame.dtype, self.frame_shape, self.dtype))
+            self.chunks = []
+            self.frame_shape = frame.shape
+            self.dtype = frame.dtype
+
+        chunk, slot = divmod(self.count, self.chunk_frames)
+        if chunk == len(self.chunks):
+            self.chunks.append(np.empty((self.chunk_frames,) + self.frame_shape, dtype=self.dtype))
+        np.copyto(self.chunks[chunk][slot], frame)
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+        if self.spill_path is not None:
+            self.chunks = []
+            os.remove(self.spill_path)
+            self.spill_path = None
+
+    def spill(self, path):
+        if self.spill_path is not None or self.count == 0:
+            return
+        spilled = np.memmap(path, dtype=self.dtype, mode="w+", shape=(self.count,) + self.frame_shape)
+        for start in range(0, self.count, self.chunk_frames):
+            stop = min(start + self.chunk_frames, self.count)
+            spilled[start:stop] = self.chunks[start // self.chunk_frames][:stop - start]
+        spilled.flush()
+        del spilled
+
+        spilled = np.memmap(path, dtype=self.dtype, mode="r", shape=(self.count,) + self.frame_shape)
+        self.chunks = [spilled[start:start + self.chunk_frames] for start in range(0, self.count, self.chunk_frames)]
+        self.spill_path = path
+
+    @property
+    def nbytes(self):
+        # bytes held in memory, spilled frames are not counted
+        if self.spill_path is not None:
+            return 0
+        return sum(chunk.nbytes for chunk in self.chunks)
+
+    @property
+    def used_bytes(self):
+        if self.frame_shape is None:
+            return 0
+        return self.count * int(np.prod(self.frame_shape)) * self.dtype.itemsize
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("frame index {} out of range".format(i))
+        chunk, slot = divmod(i, self.chunk_frames)
+        return self.chunks[chunk][slot]
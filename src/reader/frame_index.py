@@ -0,0 +1,90 @@
+import json
+import struct
+
+import numpy as np
+
+# columnar per-take frame index, every column is stored contiguously after the header:
+#
+#   header  HEADER_FORMAT (magic, version, frame count, column count)
+#   column  frame_count values of COLUMNS[0] dtype
+#   ...
+#
+# frame_number / depth_frame_number are the device frame counters, device_timestamp / depth_timestamp the device
+# timestamps in milliseconds in timestamp_domain (rs.timestamp_domain), host_time the host clock in seconds when the
+# frameset arrived, write_offset the byte offset of the depth frame in depth_raw.cdepth or depth_raw.cdz, its file
+# number for npy frames and -1 when the depth frames failed to write.
+
+MAGIC = b"CFINDEX\x00"
+VERSION = 1
+HEADER_FORMAT = "<8sIII"
+COLUMNS = [
+    ("frame_number", "<i8"),
+    ("depth_frame_number", "<i8"),
+    ("device_timestamp", "<f8"),
+    ("depth_timestamp", "<f8"),
+    ("timestamp_domain", "<u1"),
+    ("host_time", "<f8"),
+    ("write_offset", "<i8"),
+]
+
+
+class FrameIndexError(Exception):
+    pass
+
+
+def write_frame_index(path, rows, write_offsets):
+    # rows are (frame_number, depth_frame_number, device_timestamp, depth_timestamp, timestamp_domain, host_time)
+    columns = [np.asarray([row[i] for row in rows], dtype=dtype) for i, (name, dtype) in enumerate(COLUMNS[:-1])]
+    columns.append(np.asarray(write_offsets, dtype=COLUMNS[-1][1]))
+    with open(path, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(rows), len(COLUMNS)))
+        for column in columns:
+            f.write(column.tobytes())
+
+
+def load_frame_index(path, names=None):
+    # returns {column name: np.ndarray}, only the requested columns are read
+    with open(path, "rb") as f:
+        raw = f.read(struct.calcsize(HEADER_FORMAT))
+    magic, version, frame_count, column_count = struct.unpack(HEADER_FORMAT, raw)
+    if magic != MAGIC or version != VERSION or column_count != len(COLUMNS):
+        raise FrameIndexError("{} is not a supported frame index".format(path))
+
+    index = {}
+    offset = struct.calcsize(HEADER_FORMAT)
+    for name, dtype in COLUMNS:
+        if names is None or name in names:
+            index[name] = np.fromfile(path, dtype=dtype, count=frame_count, offset=offset)
+        offset += frame_count * np.dtype(dtype).itemsize
+    return index
+
+
+def frame_report(index, fps=60):
+    frame_number = index["frame_number"]
+    report = {"frames": int(len(frame_number)), "fps": fps}
+    if len(frame_number) < 2:
+        return report
+
+    gaps = np.diff(frame_number)
+    intervals = np.diff(index["device_timestamp"])
+    host_intervals = np.diff(index["host_time"]) * 1000
+    expected = 1000.0 / fps
+    report.update({
+        "dropped_frames": int(np.clip(gaps - 1, 0, None).sum()),
+        "drop_events": int((gaps > 1).sum()),
+        "repeated_frames": int((gaps <= 0).sum()),
+        "duration_ms": float(index["device_timestamp"][-1] - index["device_timestamp"][0]),
+        "interval_mean_ms": float(intervals.mean()),
+        "interval_std_ms": float(intervals.std()),
+        "interval_max_ms": float(intervals.max()),
+        "interval_p99_ms": float(np.percentile(intervals, 99)),
+        "late_intervals": int((intervals > 1.5 * expected).sum()),
+        "host_interval_std_ms": float(host_intervals.std()),
+        "host_interval_max_ms": float(host_intervals.max()),
+    })
+    return report
+
+
+def write_frame_report(path, report):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,227 @@
+import bisect
+import threading
+
+# upper bounds in seconds, from a fraction of a frame interval up to a long take
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.0167, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                   60.0, 120.0)
+
+STAGES = ("wait", "align", "copy", "queue_wait", "encode", "write", "move", "preview")
+
+
+def format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in labels) + "}"
+
+
+class Counter:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    # either set explicitly or read from `f()` on every scrape
+    __slots__ = ("value", "f")
+
+    def __init__(self, f=None):
+        self.value = 0
+        self.f = f
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.f() if self.f is not None else self.value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.get())]
+
+    def snapshot(self):
+        return self.get()
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "max", "lock")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        samples = []
+        cumulative = 0
+        for le, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            samples.append((name + "_bucket", labels + (("le", format_value(le)),), cumulative))
+        samples.append((name + "_sum", labels, total))
+        samples.append((name + "_count", labels, count))
+        return samples
+
+    def snapshot(self):
+        with self.lock:
+            return {"counts": list(self.counts), "count": self.count, "sum": self.sum, "max": self.max}
+
+    def summary(self, before=None):
+        # count / mean / approximate p50, p99 of the observations since the snapshot `before`
+        now = self.snapshot()
+        counts, count, total = now["counts"], now["count"], now["sum"]
+        if before is not None:
+            counts = [a - b for a, b in zip(counts, before["counts"])]
+            count, total = count - before["count"], total - before["sum"]
+        d = {"count": count, "sum": total, "mean": total / count if count > 0 else 0.0}
+        for q in (0.5, 0.99):
+            d["p{:d}".format(int(q * 100))] = self.quantile(counts, count, q)
+        if before is None:
+            d["max"] = now["max"]
+        return d
+
+    def quantile(self, counts, count, q):
+        # upper bound of the bucket holding the q quantile
+        if count <= 0:
+            return 0.0
+        cumulative = 0
+        for le, n in zip(self.buckets + (self.max,), counts):
+            cumulative += n
+            if cumulative >= q * count:
+                return le
+        return self.max
+
+
+class Family:
+    # one metric name, with a child metric per value of its label (or a single child without label)
+    __slots__ = ("name", "help", "kind", "label", "factory", "children", "lock")
+
+    def __init__(self, name, help, kind, label, factory):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label = label
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, value=None):
+        child = self.children.get(value)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(value, self.factory())
+        return child
+
+    def exposition(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.kind)]
+        for value, child in list(self.children.items()):
+            labels = () if self.label is None else ((self.label, value),)
+            for name, sample_labels, v in child.samples(self.name, labels):
+                lines.append("{}{} {}".format(name, format_labels(sample_labels), format_value(v)))
+        return lines
+
+
+class Registry:
+    # metrics are only recorded while `enabled` is set, so disabled instrumentation costs an attribute check
+
+    def __init__(self):
+        self.enabled = False
+        self.families = {}
+
+    def add(self, name, help, kind, label, factory):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = Family(name, help, kind, label, factory)
+            if label is None:
+                family.labels()
+        return family
+
+    def counter(self, name, help, label=None):
+        return self.add(name, help, "counter", label, Counter)
+
+    def gauge(self, name, help, f=None):
+        family = self.add(name, help, "gauge", None, Gauge)
+        if f is not None:
+            family.labels().f = f
+        return family
+
+    def histogram(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        return self.add(name, help, "histogram", label, lambda: Histogram(buckets))
+
+    def exposition(self):
+        # prometheus text format 0.0.4
+        lines = []
+        for family in list(self.families.values()):
+            lines.extend(family.exposition())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {name: {value: child.snapshot() for value, child in list(family.children.items())}
+                for name, family in list(self.families.items())}
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram("recorder_stage_seconds", "seconds spent per pipeline stage.", "stage")
+for each in STAGES:
+    stage_seconds.labels(each)
+frames_total = registry.counter("recorder_frames_total", "frames captured while recording.", "reader")
+dropped_frames_total = registry.counter("recorder_dropped_frames_total", "frames lost by the sensor.", "reader")
+takes_total = registry.counter("recorder_takes_total", "takes finished by the writer.")
+modal_errors_total = registry.counter("recorder_modal_errors_total", "modals that failed to save.")
+written_bytes_total = registry.counter("recorder_written_bytes_total", "bytes of finished takes.")
+preview_dropped_total = registry.counter("recorder_preview_dropped_total",
+                                         "previews replaced before the window showed them.", "reader")
+
+
+def observe(stage, seconds):
+    if registry.enabled:
+        stage_seconds.labels(stage).observe(seconds)
+
+
+def count(family, n=1, label=None):
+    if registry.enabled:
+        family.labels(label).inc(n)
+
+
+def stage_summary(before=None):
+    # {stage: summary} of every stage with observations since `before`, a snapshot of `stage_snapshot`
+    d = {}
+    for stage, histogram in list(stage_seconds.children.items()):
+        summary = histogram.summary(None if before is None else before.get(stage))
+        if summary["count"] > 0:
+            d[stage] = summary
+    return d
+
+
+def stage_snapshot():
+    return {stage: histogram.snapshot() for stage, histogram in list(stage_seconds.children.items())}
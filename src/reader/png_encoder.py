@@ -0,0 +1,81 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from reader import checksums, metrics
+from reader.profiling import profiler
+
+
+class PngEncodeJob:
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+        self.futures = []
+        self.frames = 0
+        self.raw_bytes = 0
+        self.start_time = time.time()
+
+    def submit(self, path, image):
+        self.frames += 1
+        self.raw_bytes += image.nbytes
+        self.futures.append(self.pool.submit(path, image))
+
+    def close(self):
+        failed = 0
+        for f in self.futures:
+            if not f.result():
+                failed += 1
+        self.futures = []
+
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        print("PngEncoderPool: {} encoded {} frames in {:.2f}s ({:.1f} fps, {:.1f} MB/s raw, {} workers, level {})".format(
+            self.name, self.frames, elapsed, self.frames / elapsed, self.raw_bytes / elapsed / 1e6,
+            self.pool.workers, self.pool.compression))
+        if failed > 0:
+            print("[WARN] PngEncoderPool: {} frames of {} failed to encode".format(failed, self.name))
+        return self.frames / elapsed
+
+
+class PngEncoderPool:
+    # cv2.imencode releases the GIL while encoding, so a thread pool scales with the number of cores.
+    # the encoded bytes are hashed before they are written, so the file is never read back for its checksum.
+    # at most `2 * workers` frames are pending in the pool, `submit` blocks beyond that.
+
+    def __init__(self, args):
+        self.workers = max(1, args.png_workers)
+        self.compression = args.png_compression
+        self.params = [cv2.IMWRITE_PNG_COMPRESSION, self.compression]
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="png-encoder")
+        self.pending = threading.BoundedSemaphore(2 * self.workers)
+
+    def job(self, name):
+        return PngEncodeJob(self, name)
+
+    def _write(self, path, image):
+        encode_start = time.perf_counter()
+        try:
+            with profiler.task():
+                ok, data = cv2.imencode(".png", image, self.params)
+                if not ok:
+                    return False
+                with open(path, "wb") as f:
+                    f.write(data)
+                checksums.registry.record(path, checksums.digest(data))
+                return True
+        finally:
+            self.pending.release()
+            metrics.observe("encode", time.perf_counter() - encode_start)
+
+    def submit(self, path, image):
+        self.pending.acquire()
+        try:
+            return self.executor.submit(self._write, path, image)
+        except Exception:
+            # _write never runs (e.g. the pool is shut down), give the slot back
+            self.pending.release()
+            raise
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from reader import metrics
+
+
+class FramePreview:
+    # downscaled preview of a reader's frames for the window, rendered at most `fps` times per second.
+    # frames are resized, rotated and flipped into preallocated buffers. three output buffers are used as a
+    # mailbox: the reader renders into one, the newest finished one waits for the window, and the window shows
+    # the third. a preview the window hasn't taken when the next one is finished is dropped, never queued.
+
+    def __init__(self, name, fps, size, rotate=None, flip=False):
+        self.name = name
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.size = size
+        self.rotate = rotate
+        self.flip = flip
+        self.steps = [self.resize] + ([self.rotate_to] if rotate is not None else []) + ([self.flip_to] if flip else [])
+        self.next_due = 0.0
+        self.stages = None
+        self.buffers = None
+        self.lock = threading.Lock()
+        self.writing, self.latest, self.reading = 0, None, None
+        self.cpu_seconds = 0.0
+        self.frames = 0
+        self.dropped = 0
+
+    def due(self):
+        # check before fetching a frame only for the preview
+        return time.monotonic() >= self.next_due
+
+    def submit(self, frame):
+        now = time.monotonic()
+        if now < self.next_due:
+            return
+        self.next_due = now + self.interval
+        cpu_start = time.thread_time()
+        if self.buffers is None or self.buffers[0].shape[2:] != frame.shape[2:] or self.buffers[0].dtype != frame.dtype:
+            self.allocate(frame)
+
+        src = frame
+        for i, step in enumerate(self.steps):
+            dst = self.buffers[self.writing] if i == len(self.steps) - 1 else self.stages[i]
+            step(src, dst)
+            src = dst
+
+        with self.lock:
+            if self.latest is not None:
+                self.dropped += 1
+                metrics.count(metrics.preview_dropped_total, 1, self.name)
+            self.latest = self.writing
+            self.writing = next(i for i in range(3) if i != self.latest and i != self.reading)
+        seconds = time.thread_time() - cpu_start
+        self.cpu_seconds += seconds
+        self.frames += 1
+        metrics.observe("preview", seconds)
+
+    def resize(self, src, dst):
+        cv2.resize(src, self.size, dst=dst)
+
+    def rotate_to(self, src, dst):
+        cv2.rotate(src, self.rotate, dst=dst)
+
+    def flip_to(self, src, dst):
+        cv2.flip(src, 1, dst=dst)
+
+    def allocate(self, frame):
+        width, height = self.size
+        channels = frame.shape[2:]
+        resized = (height, width) + channels
+        rotated = (width, height) + channels if self.rotate in (cv2.ROTATE_90_CLOCKWISE,
+                                                                  cv2.ROTATE_90_COUNTERCLOCKWISE) else resized
+        # the results of every step but the last, which writes into an output buffer
+        self.stages = [np.empty(resized, dtype=frame.dtype)]
+        if self.rotate is not None:
+            self.stages.append(np.empty(rotated, dtype=frame.dtype))
+        self.buffers = [np.empty(rotated, dtype=frame.dtype) for _ in range(3)]
+        with self.lock:
+            self.writing, self.latest, self.reading = 0, None, None
+
+    def take(self):
+        # newest preview not taken yet or None, the buffer stays valid until the next call
+        with self.lock:
+            if self.latest is None:
+                return None
+            self.reading, self.latest = self.latest, None
+            return self.buffers[self.reading]
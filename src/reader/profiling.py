@@ -0,0 +1,194 @@
+import cProfile
+import contextlib
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+from reader.reader_callback import ReaderCallback
+
+
+class ProfileSession:
+    # the per thread profiles of one take, from notify_record until the writer has saved the take
+    def __init__(self):
+        self.profiles = {}
+        self.active = 0
+        self.lock = threading.Lock()
+        self.closed = False
+        self.take = None
+        self.started = time.time()
+        self.record_snapshot = None
+
+    def profile_for(self, name):
+        with self.lock:
+            profile = self.profiles.get(name)
+            if profile is None:
+                profile = self.profiles[name] = cProfile.Profile()
+            return profile
+
+    def attach(self, n):
+        with self.lock:
+            self.active += n
+
+    def wait_detached(self, timeout):
+        deadline = time.time() + timeout
+        while self.active > 0 and time.time() < deadline:
+            time.sleep(0.01)
+        return self.active == 0
+
+
+class TakeProfiler(ReaderCallback):
+    # cProfile of the reader / writer threads and tracemalloc snapshots per take, written to <take>/profile.
+    # cProfile only sees the thread it is enabled in, so loop threads call `checkpoint` every iteration to attach
+    # to or detach from the running session, and pool threads wrap their work in `task`. only one take is profiled
+    # at a time, a take recorded while the previous one is still being saved is skipped.
+    # python 3.12 moved cProfile onto sys.monitoring, which allows one active profiler per process, so threads
+    # that can't enable their profiler are left out of the take.
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_frames = 10
+        self.session = None
+        self.attached = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def notify_record(self):
+        if not self.enabled:
+            return
+        if self.session is not None:
+            print("[profile] previous take is still being saved, this take is not profiled")
+            return
+        tracemalloc.start(self.trace_frames)
+        self.session = ProfileSession()
+
+    def notify_save(self, aid, pid, sid):
+        session = self.session
+        if session is None or session.take is not None:
+            return
+        session.record_snapshot = tracemalloc.take_snapshot()
+        session.take = (aid, pid, sid)
+
+    def notify_cancel(self):
+        session = self.session
+        if session is None or session.take is not None:
+            return
+        self.close(session)
+
+    def close(self, session):
+        session.closed = True
+        if not session.wait_detached(2.0):
+            print("[profile] {} threads did not detach from the profiler".format(session.active))
+        self.session = None
+        save_snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return save_snapshot, peak
+
+    def detach(self):
+        # called by a loop thread before it exits
+        local = self.local
+        profile = getattr(local, "profile", None)
+        if profile is None:
+            return
+        profile.disable()
+        local.profile = None
+        local.session.attach(-1)
+        with self.lock:
+            self.attached -= 1
+
+    def checkpoint(self):
+        session = self.session
+        if session is None and self.attached == 0:
+            return
+        local = self.local
+        profile = getattr(local, "profile", None)
+        if profile is not None and (session is None or session.closed or local.session is not session):
+            self.detach()
+        elif profile is None and session is not None and not session.closed:
+            local.profile = session.profile_for(threading.current_thread().name)
+            local.session = session
+            session.attach(1)
+            with self.lock:
+                self.attached += 1
+            try:
+                local.profile.enable()
+            except ValueError:
+                pass
+
+    @contextlib.contextmanager
+    def task(self):
+        session = self.session
+        if session is None or session.closed:
+            yield
+            return
+        profile = session.profile_for(threading.current_thread().name)
+        session.attach(1)
+        try:
+            profile.enable()
+        except ValueError:
+            pass
+        try:
+            yield
+        finally:
+            profile.disable()
+            session.attach(-1)
+
+    def finish(self, take, take_path):
+        # called by the writer once every modal of `take` is saved
+        session = self.session
+        if session is None or session.take != take:
+            return
+        save_snapshot, peak = self.close(session)
+        profile_path = os.path.join(take_path, "profile")
+        os.makedirs(profile_path, exist_ok=True)
+
+        combined = None
+        for name, profile in session.profiles.items():
+            file_name = os.path.join(profile_path, "{}.prof".format(re.sub(r"[^\w.-]", "_", name)))
+            profile.dump_stats(file_name)
+            if combined is None:
+                combined = pstats.Stats(file_name)
+            else:
+                combined.add(file_name)
+        if combined is not None:
+            combined.dump_stats(os.path.join(profile_path, "combined.prof"))
+        if session.record_snapshot is not None:
+            session.record_snapshot.dump(os.path.join(profile_path, "record.tracemalloc"))
+        if save_snapshot is not None:
+            save_snapshot.dump(os.path.join(profile_path, "save.tracemalloc"))
+
+        summary = self.summary(session, combined, save_snapshot, peak)
+        with open(os.path.join(profile_path, "summary.txt"), "w") as f:
+            f.write(summary)
+        print("[profile] take {} saved to {}".format(take, profile_path))
+        print(summary)
+
+    @staticmethod
+    def summary(session, combined, snapshot, peak, top=10):
+        out = io.StringIO()
+        out.write("profiled {:.1f}s, {} threads, traced memory peak {:.1f} MB\n".format(
+            time.time() - session.started, len(session.profiles), peak / 1e6))
+        if combined is not None:
+            total = max(combined.total_tt, 1e-9)
+            out.write("top {} functions by own time:\n".format(top))
+            rows = sorted(combined.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+            for (file_name, line, func), (cc, nc, tt, ct, callers) in rows:
+                out.write("  {:5.1f}% {:8.3f}s {:8d} calls  {} ({}:{})\n".format(
+                    tt / total * 100, tt, nc, func, os.path.basename(file_name), line))
+        if session.record_snapshot is not None:
+            out.write("top {} allocations held at the end of recording:\n".format(top))
+            for stat in session.record_snapshot.statistics("lineno")[:top]:
+                out.write("  {:8.1f} MB {:8d} blocks  {}\n".format(stat.size / 1e6, stat.count, stat.traceback[0]))
+        if snapshot is not None and session.record_snapshot is not None:
+            out.write("top {} allocation changes during the save:\n".format(top))
+            for stat in snapshot.compare_to(session.record_snapshot, "lineno")[:top]:
+                out.write("  {:+8.1f} MB {:+8d} blocks  {}\n".format(
+                    stat.size_diff / 1e6, stat.count_diff, stat.traceback[0]))
+        return out.getvalue()
+
+
+profiler = TakeProfiler()
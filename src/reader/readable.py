@@ -1,7 +1,21 @@
 class Readable:
+    consumer = None
 
-    def poll(self):
-        raise NotImplementedError
+    def register_consumer(self, consumer):
+        self.consumer = consumer
+
+    def push(self, take, parts):
+        # hands the modalities of a finished take to the consumer, take is the (aid, pid, sid) passed to notify_save
+        # and parts is a list of (modal_name, f_save, modal_data). an empty list marks the take as skipped.
+        if self.consumer is None:
+            print("[WARN] {}: no consumer registered, dropping take {}".format(self, take))
+            return
+        self.consumer.notify_parts(self, take, parts)
+
+    def describe_parts(self, parts):
+        # json description of where the parts of a take are on disk, so the take can be written after a restart
+        # with `restore_parts`. None when some of the data only lives in memory.
+        return None
 
-    def read(self):
+    def restore_parts(self, description):
         raise NotImplementedError
@@ -1,10 +1,17 @@
 class ReaderCallback:
 
+    def accept_record(self):
+        return True
+
+    def report_status(self):
+        # station health values reported to the master, see netsync.STATUS_FIELDS
+        return {}
+
     def notify_record(self):
         print("default record callback handler called on", self)
         pass
 
-    def notify_save(self, aid, pid):
+    def notify_save(self, aid, pid, sid):
         print("default save callback handler called on", self)
         pass
 
@@ -0,0 +1,271 @@
+import json
+import os
+import queue
+import time
+
+import cv2
+import numpy as np
+
+from reader import metrics
+from reader.color_writers import open_color_writer
+from reader.depth_writers import open_depth_writer
+from reader.frame_index import frame_report, write_frame_index, write_frame_report
+from reader.png_encoder import PngEncoderPool
+from reader.preview import FramePreview
+from reader.profiling import profiler
+from reader.readable import Readable
+from reader.reader_callback import ReaderCallback
+from reader.runnable import Runnable
+from reader.stream_writer import StreamWriter
+from reader.utils import random_string
+from reader.write_info import WriteInfo
+from recorder_controller import RecorderController
+
+
+class RgbdReader(Runnable, ReaderCallback, Readable):
+    # records and saves 848x480 color / depth frames, subclasses provide the frames with `read_frames` and the
+    # stream calibration in `self.calibration` before calling this constructor.
+
+    def __init__(self, args, controller: RecorderController):
+        super(RgbdReader, self).__init__(args)
+        self.controller = controller
+        self.spare_infos = queue.Queue()
+        self.encoder = PngEncoderPool(args)
+        self.memory_budget = None
+        self.window = None
+        self.is_recording = False
+        self.save_signal = False
+        self.save_take = None
+        self.anchors = {}
+        self.dropped_frames = 0
+        self.capture_fps = 0.0
+        self.preview = FramePreview("realsense", args.preview_fps, (480, 270),
+                                    cv2.ROTATE_90_COUNTERCLOCKWISE if args.layout == "portrait" else None)
+        self.cancel_signal = False
+        self.controller.register_reader(self)
+        metrics.registry.gauge("recorder_capture_fps", "realsense frames per second.", lambda: self.capture_fps)
+
+    def read_frames(self):
+        # blocks until the next frame pair, returns (color_image, depth_image, meta) with
+        # meta = (color frame number, depth frame number, color timestamp, depth timestamp, timestamp domain, host time)
+        raise NotImplementedError
+
+    def write_calibration(self, modal_path):
+        if self.args.raw_capture:
+            with open(os.path.join(modal_path, "calibration.json"), "w") as f:
+                json.dump(self.calibration, f, indent=2)
+
+    def stop(self):
+        super(RgbdReader, self).stop()
+        self.encoder.shutdown()
+
+    def register_window(self, window):
+        self.window = window
+        window.register_preview("realsense", self.preview)
+
+    def report_status(self):
+        return {"dropped_frames": self.dropped_frames, "capture_fps": self.capture_fps}
+
+    def register_memory_budget(self, memory_budget):
+        self.memory_budget = memory_budget
+
+    def notify_record(self):
+        print("RealsenseReader: notified to recording")
+        self.anchors = {"record": time.time()}
+        self.is_recording = True
+        self.save_signal = False
+        self.cancel_signal = False
+
+    def notify_save(self, aid, pid, sid):
+        print("RealsenseReader: notified to saving")
+        self.anchors["save"] = time.time()
+        self.save_take = (aid, pid, sid)
+        self.is_recording = False
+        self.save_signal = True
+        self.cancel_signal = False
+
+    def notify_cancel(self):
+        print("RealsenseReader: notified to cancelling")
+        self.is_recording = False
+        self.save_signal = False
+        self.cancel_signal = True
+
+    def proc(self):
+        write_info = self.new_write_info()
+        last_frame_number = None
+        fps_start, fps_frames = time.time(), 0
+
+        while self.working:
+            profiler.checkpoint()
+            # mostly blocking until the sensor delivers the next frameset, align is observed on its own
+            read_start = time.perf_counter()
+            color_image, depth_image, meta = self.read_frames()
+            metrics.observe("wait", time.perf_counter() - read_start)
+            frame_number, host_time = meta[0], meta[5]
+
+            if last_frame_number is not None and frame_number > last_frame_number + 1:
+                self.dropped_frames += frame_number - last_frame_number - 1
+                metrics.count(metrics.dropped_frames_total, frame_number - last_frame_number - 1, "realsense")
+            last_frame_number = frame_number
+            fps_frames += 1
+            if host_time - fps_start >= 1.0:
+                self.capture_fps = fps_frames / (host_time - fps_start)
+                fps_start, fps_frames = host_time, 0
+
+            if self.is_recording:
+                copy_start = time.perf_counter()
+                write_info.frame_meta.append(meta)
+                if self.args.stream_write:
+                    if write_info.stream is None:
+                        write_info.stream = StreamWriter(self.args, os.path.join(
+                            self.args.path, ".realsense_stream.{}".format(random_string(5))), self.encoder)
+                        write_info.stream.start()
+                        self.write_calibration(os.path.join(write_info.stream.path, "depth_raw"))
+                    write_info.stream.put(color_image.copy(), depth_image.copy(), meta[3])
+                else:
+                    write_info.frames_color.append(color_image)
+                    write_info.frames_depth.append(depth_image)
+                metrics.observe("copy", time.perf_counter() - copy_start)
+                metrics.count(metrics.frames_total, 1, "realsense")
+            else:
+                if self.window:
+                    self.preview.submit(color_image)
+                if self.save_signal:
+                    print("RealsenseReader: a writeInfo is pushed to the writer, {} frames, {:.1f} MB buffered".format(
+                        len(write_info.frame_meta), write_info.nbytes / 1e6))
+                    aid, pid, sid = self.save_take
+                    write_info.set_action_id(aid)
+                    write_info.set_person_id(pid)
+                    write_info.anchors = self.anchors
+                    if write_info.stream is not None:
+                        write_info.stream.finish()
+                    elif self.memory_budget is not None:
+                        self.memory_budget.track(write_info)
+                    self.push(self.save_take, self.save_parts(write_info))
+                if self.cancel_signal and write_info.stream is not None:
+                    write_info.stream.discard()
+                if self.save_signal or self.cancel_signal:
+                    self.is_recording = False
+                    if self.save_signal:
+                        write_info = self.new_write_info()
+                    else:
+                        write_info.reset(self.controller.aid, self.controller.pid)
+                    self.save_signal = False
+                    self.cancel_signal = False
+
+    def new_write_info(self):
+        try:
+            write_info = self.spare_infos.get(block=False)
+            write_info.reset(self.controller.aid, self.controller.pid)
+            return write_info
+        except queue.Empty:
+            return WriteInfo(self.controller.aid, self.controller.pid, self.args.arena_chunk)
+
+    def recycle_write_info(self, write_info):
+        if self.memory_budget is not None:
+            self.memory_budget.untrack(write_info)
+        if write_info.is_spilled:
+            write_info.reset()
+            return
+        # keep one take worth of frame blocks around, so the next take doesn't allocate them again
+        if self.spare_infos.qsize() < 1:
+            self.spare_infos.put(write_info)
+
+    def save_parts(self, job):
+        if job.stream is not None:
+            print("RealsenseReader: pushing streamed save job ", job.stream.count)
+            job.pending_modals = 1
+            return [(modal_name, self.save_stream, job.stream) for modal_name in StreamWriter.modal_names] + [
+                ("frame_index", self.save_index, job)
+            ]
+        print("RealsenseReader: pushing save job ", len(job.frames_color), len(job.frames_depth))
+        job.pending_modals = 3
+        return [
+            ("color", self.save_data, job),
+            # ("depth", self.save_data, job.frames_depth),
+            ("depth_raw", self.save_data, job),
+            ("frame_index", self.save_index, job)
+        ]
+
+    def describe_parts(self, parts):
+        if len(parts) == 0:
+            return []
+        job = parts[-1][2]
+        if job.stream is None:
+            # buffered in memory or spilled to scratch files that don't outlive the process
+            return None
+        # the take is on disk once the stream writer has flushed it
+        job.stream.join()
+        return {"stream": job.stream.path, "frame_meta": job.frame_meta, "anchors": job.anchors,
+                "depth_offsets": job.stream.depth_offsets}
+
+    def restore_parts(self, description):
+        if len(description) == 0:
+            return []
+        job = WriteInfo(self.controller.aid, self.controller.pid, self.args.arena_chunk)
+        job.frame_meta = [tuple(m) for m in description["frame_meta"]]
+        job.anchors = description["anchors"]
+        job.stream = StreamWriter(self.args, description["stream"], self.encoder, create=False)
+        job.stream.depth_offsets = description["depth_offsets"]
+        return self.save_parts(job)
+
+    def save_data(self, modal_path, modal_data):
+        print("RealsenseReader: saving job ...", modal_path)
+        modal_data.begin_save()
+        if modal_path.endswith("depth_raw"):
+            frames, frame_meta = modal_data.frames_depth, modal_data.frame_meta
+            try:
+                depth_writer = open_depth_writer(self.args.depth_format, modal_path)
+                for i in range(len(frames)):
+                    depth_writer.append(frames[i], frame_meta[i][3])
+                depth_writer.close()
+                modal_data.depth_offsets = depth_writer.write_offsets()
+            finally:
+                modal_data.depth_written.set()
+            self.write_calibration(modal_path)
+        else:
+            frames = modal_data.frames_color
+            color_writer = open_color_writer(self.args.color_format, modal_path, self.encoder)
+            for i in range(len(frames)):
+                color_writer.append(frames[i])
+            color_writer.close()
+
+        if modal_data.release_modal():
+            self.recycle_write_info(modal_data)
+
+    def save_index(self, modal_path, modal_data):
+        frame_meta = modal_data.frame_meta
+        write_offsets = self.depth_offsets(modal_data)
+        if write_offsets is None or len(write_offsets) != len(frame_meta):
+            print("[WARN] RealsenseReader: no depth write offsets for", modal_path)
+            write_offsets = [-1] * len(frame_meta)
+        write_frame_index(os.path.join(modal_path, "realsense.cfi"), frame_meta, write_offsets)
+
+        report = frame_report({
+            "frame_number": np.asarray([m[0] for m in frame_meta], dtype=np.int64),
+            "device_timestamp": np.asarray([m[2] for m in frame_meta]),
+            "host_time": np.asarray([m[5] for m in frame_meta]),
+        })
+        report["anchors"] = modal_data.anchors
+        write_frame_report(os.path.join(modal_path, "realsense_report.json"), report)
+        print("RealsenseReader: {} frames, {} dropped, interval {:.2f} +- {:.2f} ms (max {:.2f} ms): {}".format(
+            report["frames"], report.get("dropped_frames", 0), report.get("interval_mean_ms", 0),
+            report.get("interval_std_ms", 0), report.get("interval_max_ms", 0), modal_path))
+
+        if modal_data.release_modal():
+            self.recycle_write_info(modal_data)
+
+    def depth_offsets(self, job):
+        # the offsets are only known once the depth frames are written. the depth modal of a buffered take is
+        # submitted to the writer before the frame index, so it is running by the time this waits for it
+        if job.stream is not None:
+            job.stream.join()
+            return job.stream.depth_offsets
+        job.depth_written.wait()
+        return job.depth_offsets
+
+    def save_stream(self, modal_path, modal_data):
+        print("RealsenseReader: moving streamed job ...", modal_path)
+        move_start = time.perf_counter()
+        modal_data.move_modal(os.path.basename(modal_path), modal_path)
+        metrics.observe("move", time.perf_counter() - move_start)
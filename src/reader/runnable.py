@@ -12,7 +12,7 @@ class Runnable(metaclass=abc.ABCMeta):
         if self.working or self.worker is not None:
             return
         self.working = True
-        self.worker = threading.Thread(target=self.proc)
+        self.worker = threading.Thread(target=self.proc, name=type(self).__name__)
         self.worker.start()
 
     def stop(self):
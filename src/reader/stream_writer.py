@@ -0,0 +1,87 @@
+import os
+import queue
+import shutil
+
+from reader import checksums
+from reader.color_writers import open_color_writer
+from reader.depth_writers import open_depth_writer
+from reader.profiling import profiler
+from reader.runnable import Runnable
+
+
+class StreamWriter(Runnable):
+    # writes the frames of one take into a staging directory while the take is still recording,
+    # holding at most `args.stream_window` frames in memory.
+
+    modal_names = ("color", "depth_raw")
+
+    def __init__(self, args, path, encoder, create=True):
+        super(StreamWriter, self).__init__(args)
+        self.path = path
+        self.encoder = encoder
+        self.frames = queue.Queue(maxsize=max(1, args.stream_window))
+        self.count = 0
+        self.discarded = False
+        # write offsets of the depth frames for the frame index, known once the stream is written
+        self.depth_offsets = None
+        # a restored stream writer only moves the modals a previous run has written
+        for modal_name in self.modal_names if create else ():
+            os.makedirs(os.path.join(self.path, modal_name), exist_ok=True)
+
+    def put(self, color_image, depth_image, timestamp):
+        item = (self.count, color_image, depth_image, timestamp)
+        self.count += 1
+        try:
+            self.frames.put(item, block=False)
+        except queue.Full:
+            print("[WARN] StreamWriter: in-flight window is full, capture is waiting for the writer.")
+            self.frames.put(item)
+
+    def finish(self):
+        self.frames.put(None)
+
+    def discard(self):
+        self.discarded = True
+        self.frames.put(None)
+
+    def join(self):
+        if self.worker is not None:
+            self.worker.join()
+        self.working = False
+        self.worker = None
+
+    def proc(self):
+        color_writer = open_color_writer(self.args.color_format, os.path.join(self.path, "color"), self.encoder)
+        depth_writer = open_depth_writer(self.args.depth_format, os.path.join(self.path, "depth_raw"))
+        while True:
+            profiler.checkpoint()
+            item = self.frames.get()
+            if item is None:
+                break
+            if self.discarded:
+                continue
+            _, color_image, depth_image, timestamp = item
+            color_writer.append(color_image)
+            depth_writer.append(depth_image, timestamp)
+        color_writer.close()
+        depth_writer.close()
+        self.depth_offsets = depth_writer.write_offsets()
+        profiler.detach()
+
+        if self.discarded:
+            print("StreamWriter: discarding", self.path)
+            shutil.rmtree(self.path, ignore_errors=True)
+            checksums.registry.discard(self.path)
+
+    def move_modal(self, modal_name, modal_path):
+        self.join()
+        staged_path = os.path.join(self.path, modal_name)
+        if not os.path.isdir(staged_path):
+            # moved already by a write that was interrupted before its commit
+            return
+        if os.path.isdir(modal_path):
+            shutil.rmtree(modal_path)
+        shutil.move(staged_path, modal_path)
+        checksums.registry.move(staged_path, modal_path)
+        if len(os.listdir(self.path)) == 0:
+            os.rmdir(self.path)
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import numpy as np
+
+from reader.event_stream_reader import EventStreamReader
+from reader.rgbd_reader import RgbdReader
+from recorder_controller import RecorderController
+
+WIDTH, HEIGHT = 848, 480
+EVENT_WIDTH, EVENT_HEIGHT = 1280, 800
+
+
+def synthetic_color(count, seed=0):
+    # smooth gradients with some sensor noise, so PNG encoding costs about as much as on camera images
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    frames = []
+    for i in range(count):
+        shift = i * 7
+        image = np.empty((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        image[..., 0] = (x + shift) % 256
+        image[..., 1] = (y + 2 * shift) % 256
+        image[..., 2] = ((x + y) // 4 + shift) % 256
+        image += rng.integers(0, 8, size=image.shape, dtype=np.uint8)
+        frames.append(image)
+    return frames
+
+
+def synthetic_depth(count, seed=1):
+    # a tilted plane between 0.5 and 4 m in 1 mm units with a few mm of noise
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    frames = []
+    for i in range(count):
+        plane = 500 + (x * 2 + y * 3 + i * 11) % 3500
+        frames.append((plane + rng.integers(0, 6, size=plane.shape)).astype(np.uint16))
+    return frames
+
+
+def synthetic_calibration():
+    intrinsics = {
+        "width": WIDTH, "height": HEIGHT, "ppx": WIDTH / 2, "ppy": HEIGHT / 2, "fx": 600.0, "fy": 600.0,
+        "model": "brown_conrady", "coeffs": [0.0] * 5,
+    }
+    return {
+        "aligned": False,
+        "depth_scale": 0.001,
+        "depth_intrinsics": dict(intrinsics),
+        "color_intrinsics": dict(intrinsics),
+        "extrinsics": {"rotation": [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0], "translation": [0.0, 0.0, 0.0]},
+    }
+
+
+class SyntheticRgbdReader(RgbdReader):
+    # 848x480 color / depth frames at `args.synthetic_fps` without a camera. frames are paced against the wall
+    # clock, a frame that can't be delivered on time is skipped like a sensor dropping it.
+
+    def __init__(self, args, controller: RecorderController):
+        self.calibration = synthetic_calibration()
+        self.frames_color = synthetic_color(8)
+        self.frames_depth = synthetic_depth(8)
+        self.interval = 1.0 / args.synthetic_fps
+        self.start_time = None
+        self.frame_number = 0
+        super(SyntheticRgbdReader, self).__init__(args, controller)
+
+    def read_frames(self):
+        if self.start_time is None:
+            self.start_time = time.time()
+        due = self.start_time + self.frame_number * self.interval
+        now = time.time()
+        if due > now:
+            time.sleep(due - now)
+        elif now - due >= self.interval:
+            self.frame_number = int((now - self.start_time) / self.interval)
+        host_time = time.time()
+
+        frame_number = self.frame_number
+        self.frame_number += 1
+        timestamp = (self.start_time + frame_number * self.interval) * 1000
+        i = frame_number % len(self.frames_color)
+        return self.frames_color[i], self.frames_depth[i], (frame_number, frame_number, timestamp, timestamp, 0,
+                                                             host_time)
+
+
+class SyntheticEventReader(EventStreamReader):
+    # writes `args.synthetic_event_rate` MB/s of random event data to the take file without a sensor
+
+    def __init__(self, args, controller: RecorderController):
+        rng = np.random.default_rng(2)
+        self.block = rng.integers(0, 256, size=1 << 20, dtype=np.uint8).tobytes()
+        self.preview = (rng.random((EVENT_HEIGHT, EVENT_WIDTH)) < 0.05).astype(np.uint8) * 255
+        self.rate = args.synthetic_event_rate * 1024 * 1024
+        self.recording = None
+        self.recorder = None
+        super(SyntheticEventReader, self).__init__(args, controller)
+
+    def start_recording(self, path):
+        self.recording = threading.Event()
+        self.recorder = threading.Thread(target=self.record, args=(path, self.recording), daemon=True)
+        self.recording.set()
+        self.recorder.start()
+
+    def stop_recording(self):
+        self.recording.clear()
+        self.recorder.join()
+        self.recorder = None
+
+    def record(self, path, recording):
+        start, written = time.time(), 0
+        with open(path, "wb") as f:
+            while recording.is_set():
+                due = int((time.time() - start) * self.rate)
+                while written < due:
+                    n = min(due - written, len(self.block))
+                    f.write(self.block[:n])
+                    written += n
+                f.flush()
+                time.sleep(0.01)
+
+    def read_preview(self):
+        return self.preview
@@ -0,0 +1,5 @@
+import os
+
+
+def random_string(length: int):
+    return "".join("{:02x}".format(x) for x in os.urandom(length))
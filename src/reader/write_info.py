@@ -1,12 +1,77 @@
+import threading
+
+from reader.frame_arena import FrameArena
+
+
 class WriteInfo:
-    def __init__(self, action_id=0, person_id=0):
-        self.frames_color = []
-        self.frames_depth = []
+    __slots__ = ("frames_color", "frames_depth", "frame_meta", "action_id", "people_id", "stream",
+                 "anchors", "pending_modals", "lock", "depth_offsets", "depth_written", "saving", "spilling")
+
+    def __init__(self, action_id=0, person_id=0, chunk_frames=60):
+        self.frames_color = FrameArena(chunk_frames)
+        self.frames_depth = FrameArena(chunk_frames)
+        self.frame_meta = []
         self.action_id = action_id
         self.people_id = person_id
+        self.stream = None
+        self.anchors = {}
+        self.pending_modals = 0
+        self.lock = threading.Lock()
+        # write offsets the depth writer reported for the frame index, set along with depth_written
+        self.depth_offsets = None
+        self.depth_written = threading.Event()
+        # the writer started reading the frames / the memory budget is moving them to a scratch file
+        self.saving = False
+        self.spilling = False
 
     def set_action_id(self, action_id):
         self.action_id = action_id
 
     def set_person_id(self, person_id):
         self.people_id = person_id
+
+    def reset(self, action_id=0, person_id=0):
+        self.frames_color.reset()
+        self.frames_depth.reset()
+        self.frame_meta = []
+        self.action_id = action_id
+        self.people_id = person_id
+        self.stream = None
+        self.anchors = {}
+        self.pending_modals = 0
+        self.depth_offsets = None
+        self.depth_written.clear()
+        self.saving = False
+        self.spilling = False
+
+    def release_modal(self):
+        # returns True once every modal handed to the writer has been saved
+        with self.lock:
+            self.pending_modals -= 1
+            return self.pending_modals <= 0
+
+    def begin_save(self):
+        # called by the writer before it reads the frames, waits for a spill in progress to finish
+        with self.lock:
+            self.saving = True
+
+    def spill(self, path_prefix):
+        # returns False when the writer has started saving the take, it is written from memory then
+        with self.lock:
+            if self.saving:
+                return False
+            self.frames_color.spill(path_prefix + ".color")
+            self.frames_depth.spill(path_prefix + ".depth")
+            return True
+
+    @property
+    def is_spilled(self):
+        return self.frames_color.spill_path is not None
+
+    @property
+    def nbytes(self):
+        return self.frames_color.nbytes + self.frames_depth.nbytes
+
+    @property
+    def used_bytes(self):
+        return self.frames_color.used_bytes + self.frames_depth.used_bytes
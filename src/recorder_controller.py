@@ -1,9 +1,57 @@
+import heapq
+import itertools
+import shutil
 import socket
+import threading
+import time
 
 import netsync
+import netsync_async
 from reader.runnable import Runnable
 
 
+class TriggerScheduler:
+    # runs actions at a local deadline, sleeping until shortly before it and spinning for the last `spin` seconds
+
+    def __init__(self, spin=0.002):
+        self.spin = spin
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.working = True
+        self.worker = threading.Thread(target=self.proc, daemon=True)
+        self.worker.start()
+
+    def schedule(self, deadline, f, *args):
+        with self.cond:
+            heapq.heappush(self.heap, (deadline, next(self.counter), f, args))
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.working = False
+            self.cond.notify()
+        self.worker.join()
+
+    def proc(self):
+        while True:
+            with self.cond:
+                while self.working and len(self.heap) == 0:
+                    self.cond.wait()
+                if not self.working:
+                    return
+                deadline = self.heap[0][0]
+                remaining = deadline - time.time()
+                if remaining > self.spin:
+                    self.cond.wait(remaining - self.spin)
+                    continue
+                deadline, _, f, args = heapq.heappop(self.heap)
+
+            while time.time() < deadline:
+                pass
+            f(*args)
+
+
 class RecorderController(Runnable):
     def __init__(self, args):
         super(RecorderController, self).__init__(args)
@@ -11,12 +59,33 @@ class RecorderController(Runnable):
         self._aid = 0
         self._pid = 0
         self._sid = 0
-        if self.args.master:
+        self.window = None
+        self.readers = []
+        self.scheduler = TriggerScheduler()
+        self.triggers = {}
+        # created last, the network controller calls back into the controller
+        if self.args.sync_engine == "asyncio":
+            if self.args.master:
+                self.network_controller = netsync_async.AsyncSyncServer(self.args)
+            else:
+                self.network_controller = netsync_async.AsyncSyncClient(self.args, self.handle_command)
+        elif self.args.master:
             self.network_controller = netsync.SyncServer(self.args)
         else:
             self.network_controller = netsync.SyncClient(self.args)
-        self.window = None
-        self.readers = []
+        if not self.args.master:
+            self.network_controller.status_provider = self.station_status
+
+    def start(self):
+        super(RecorderController, self).start()
+        if not self.args.master:
+            # the asyncio client dispatches commands from here on
+            self.network_controller.start()
+
+    def stop(self):
+        super(RecorderController, self).stop()
+        self.scheduler.close()
+        self.network_controller.close()
 
     def register_window(self, window):
         self.window = window
@@ -68,43 +137,134 @@ class RecorderController(Runnable):
         if self.window:
             self.window.signal_id_update.emit()
 
+    def handle_command(self, command):
+        ctrl = command.get("ctrl", None)
+        if ctrl == "update":
+            self.aid = command.get("aid", 0)
+            self.pid = command.get("pid", 0)
+            self.sid = command.get("sid", 0)
+        elif ctrl == "record":
+            self.set_record(command.get("at", 0.0))
+        elif ctrl == "stop":
+            # the take is saved under the key the master stopped, the update carrying it may be lost or late
+            self.set_stop(command.get("at", 0.0), (command["aid"], command["pid"], command["sid"]))
+        elif ctrl == "cancel":
+            self.set_cancel(command.get("at", 0.0))
+
     def listen_for_sync(self):
+        # the asyncio engine calls handle_command itself as commands arrive
+        if self.args.sync_engine == "asyncio":
+            return
         while self.working:
             try:
-                command = self.network_controller.wait(timeout=0.1)[0]
-                ctrl = command.get("ctrl", None)
-                if ctrl is None:
-                    continue
-
-                if ctrl == "update":
-                    self.aid = command.get("aid", 0)
-                    self.pid = command.get("pid", 0)
-                    self.sid = command.get("sid", 0)
-                elif ctrl == "record":
-                    self.set_record()
-                elif ctrl == "stop":
-                    self.set_stop()
-                elif ctrl == "cancel":
-                    self.set_cancel()
+                self.handle_command(self.network_controller.wait(timeout=0.1)[0])
             except socket.timeout:
                 continue
 
     proc = listen_for_sync
 
-    def set_record(self):
+    def station_status(self):
+        status = {"free_disk": shutil.disk_usage(self.args.path).free}
+        for each in self.readers:
+            status.update(each.report_status())
+        return status
+
+    def station_table(self):
+        # {station name: status}, the master's own station is "local", clients carry their last clock offset / rtt
+        table = {"local": dict(self.station_status(), updated=time.time(), offset=0.0, rtt=0.0)}
+        if self.args.master:
+            clocks = self.network_controller.clock_table()
+            for address, status in self.network_controller.station_table().items():
+                clock = clocks.get(address, {})
+                status.update({key: clock[key] for key in ("offset", "rtt") if key in clock})
+                table["{}:{}".format(*address)] = status
+        return table
+
+    def station_problems(self, status):
+        problems = []
+        if time.time() - status.get("updated", 0) > 3 * self.args.status_interval:
+            problems.append("no status")
+        if status.get("queue_depth", 0) > self.args.max_write_queue:
+            problems.append("write queue {}".format(status["queue_depth"]))
+        if status.get("pending_bytes", 0) > self.args.max_pending * 2 ** 20:
+            problems.append("write backlog {:.0f} MB".format(status["pending_bytes"] / 2 ** 20))
+        if status.get("budget_refusal") is not None:
+            problems.append("memory budget: {}".format(status["budget_refusal"]))
+        if status.get("free_disk", 0) < self.args.min_free_disk * 2 ** 30:
+            problems.append("free disk {:.1f} GB".format(status.get("free_disk", 0) / 2 ** 30))
+        if status.get("capture_fps", 0) < self.args.min_capture_fps:
+            problems.append("capture {:.1f} fps".format(status.get("capture_fps", 0)))
+        return problems
+
+    def unhealthy_stations(self):
+        unhealthy = {}
+        for name, status in self.station_table().items():
+            problems = self.station_problems(status)
+            if len(problems) > 0:
+                unhealthy[name] = problems
+        return unhealthy
+
+    def master_offset(self):
+        return 0.0 if self.args.master else self.network_controller.clock.offset
+
+    def deadline(self):
+        # master time at which the next command takes effect on every station
+        return time.time() + self.args.sync_lead
+
+    def schedule_trigger(self, name, at, action, *args):
+        # at is in master time, 0 means now
+        offset = self.master_offset()
+        if at <= 0:
+            at = time.time() + offset
+        self.scheduler.schedule(at - offset, self.fire_trigger, name, at, offset, action, args)
+
+    def fire_trigger(self, name, at, offset, action, args):
+        fired = time.time()
+        error = fired + offset - at
+        self.triggers[name] = {"at": at, "fired": fired, "offset": offset, "error": error}
+        print("[sync] {} triggered {:+.3f} ms from master time {:.3f}".format(name, error * 1000, at))
+        action(*args)
+
+    def fire_record(self):
+        for each in self.readers:
+            each.notify_record()
+
+    def fire_save(self, aid, pid, sid):
+        for each in self.readers:
+            each.notify_save(aid, pid, sid)
+
+    def fire_cancel(self):
+        for each in self.readers:
+            each.notify_cancel()
+
+    def set_record(self, at=0.0):
         if not self.is_recording:
+            if not all([each.accept_record() for each in self.readers]):
+                print("[WARN] Recording refused, the station can't accept another take.")
+                return False
+
+            if self.args.master:
+                unhealthy = self.unhealthy_stations()
+                for name, problems in unhealthy.items():
+                    print("[WARN] station {} is unhealthy: {}".format(name, ", ".join(problems)))
+                if len(unhealthy) > 0 and self.args.health_policy == "refuse":
+                    print("[WARN] Recording refused, unhealthy stations.")
+                    return False
+
             self.is_recording = True
 
             if self.args.master:
-                self.network_controller.notify_start()
+                at = self.deadline()
+                self.network_controller.notify_start(at)
 
-            for each in self.readers:
-                each.notify_record()
+            self.schedule_trigger("record", at, self.fire_record)
 
             if self.window:
                 self.window.signal_status_update.emit()
+        return self.is_recording
 
-    def set_stop(self):
+    def set_stop(self, at=0.0, take=None):
+        # take is the (aid, pid, sid) to save under, the current ids by default
         if self.is_recording:
             self.is_recording = False
 
@@ -112,20 +272,24 @@ class RecorderController(Runnable):
                 self.window.signal_status_update.emit()
 
             if self.args.master:
-                self.network_controller.notify_stop()
+                at = self.deadline()
+                self.network_controller.notify_stop(at)
 
-            for each in self.readers:
-                each.notify_save(self.aid, self.pid)
+            aid, pid, sid = take if take is not None else (self.aid, self.pid, self.sid)
+            self.schedule_trigger("stop", at, self.fire_save, aid, pid, sid)
+
+            if self.args.master:
+                self.sid += 1
 
-    def set_cancel(self):
+    def set_cancel(self, at=0.0):
         if self.is_recording:
             self.is_recording = False
 
             if self.args.master:
-                self.network_controller.notify_cancel()
+                at = self.deadline()
+                self.network_controller.notify_cancel(at)
 
-            for each in self.readers:
-                each.notify_cancel()
+            self.schedule_trigger("cancel", at, self.fire_cancel)
 
             if self.window:
                 self.window.signal_status_update.emit()
@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+
+JOURNAL_NAME = ".journal.jsonl"
+
+# states of a take, in order:
+#   recorded    the take was saved on the recorder, its parts are on the way to the writer
+#   spooled     all parts arrived, "parts" is the path of a json file next to the staged recordings holding each
+#               readable's description of where its data is on disk, None for parts that only live in memory
+#   writing     the take is written into "staging", a hidden directory that is renamed to "path" on commit
+#   committed   the take directory is in place and the finalizers have run
+STATES = ("recorded", "spooled", "writing", "committed")
+
+
+class TakeJournal:
+    # append only log of take states in <path>/.journal.jsonl, one json record per line. every record is synced
+    # before the writer goes on, so after a crash the last record of a take tells how far it got. the journal is
+    # compacted to the takes not committed yet every time a take is committed.
+
+    def __init__(self, path):
+        self.path = os.path.join(path, JOURNAL_NAME)
+        self.lock = threading.Lock()
+        # merged records of the previous runs, as they were when the journal was opened
+        self.previous = self.load()
+        # merged records of the takes not committed yet, what a compacted journal holds
+        self.pending = {take_id: dict(record) for take_id, record in self.previous.items()
+                        if record["state"] != "committed"}
+        self.file = open(self.path, "a")
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def append(self, take_id, take, state, **fields):
+        record = {"id": take_id, "take": list(take), "state": state, "time": time.time()}
+        record.update(fields)
+        with self.lock:
+            if self.file is None:
+                return
+            if state == "committed":
+                self.pending.pop(take_id, None)
+                self.rewrite()
+                return
+            self.pending.setdefault(take_id, {}).update(record)
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def load(self):
+        # returns {take id: merged records} of every take in the journal, in journal order. a torn last line
+        # from a crash is skipped
+        takes = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        print("[WARN] TakeJournal: skipping a damaged record in", self.path)
+                        continue
+                    takes.setdefault(record["id"], {}).update(record)
+        except FileNotFoundError:
+            pass
+        return takes
+
+    def compact(self, takes):
+        # rewrites the journal with the merged records of `takes` out of the previous runs, takes journaled since
+        # the journal was opened are kept
+        with self.lock:
+            current = {take_id: record for take_id, record in self.pending.items() if take_id not in self.previous}
+            self.pending = {record["id"]: dict(record) for record in takes}
+            self.pending.update(current)
+            self.rewrite()
+
+    def rewrite(self):
+        # replaces the journal with the pending records, a committed take is forgotten by leaving it out. call with
+        # the lock held
+        if self.file is not None:
+            self.file.close()
+        with open(self.path + ".tmp", "w") as f:
+            for record in self.pending.values():
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.file = open(self.path, "a")
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from reader import metrics
+from reader.checksums import load_take_checksums
+from reader.reader_callback import ReaderCallback
+from reader.runnable import Runnable
+from recorder_controller import RecorderController
+
+CHUNK_SIZE = 4 * 1024 * 1024
+JOURNAL_NAME = ".mover.json"
+
+
+class TakeMover(Runnable, ReaderCallback):
+    # migrates finished takes from the local spool (`args.path` with --spool-path) to the dataset root
+    # (`args.dataset_path`), keeping the same A####P####/S## layout. takes are renamed when both are on the same
+    # filesystem, otherwise copied file by file at most `args.mover_bandwidth` MB/s and removed from the spool.
+    # the mover waits while a take is recorded or written, so it doesn't compete with capture I/O.
+    # pending takes are kept in <spool>/.mover.json and a file is copied to <name>.part first, so an interrupted
+    # move continues where it stopped on the next start. a file copied in one go is checked against the take's
+    # checksums on the way, without reading it again.
+
+    def __init__(self, args, controller: RecorderController, writer):
+        super(TakeMover, self).__init__(args)
+        self.spool_path = args.path
+        self.dataset_path = args.dataset_path
+        self.bandwidth = args.mover_bandwidth * 1024 * 1024
+        self.writer = writer
+        self.journal_path = os.path.join(self.spool_path, JOURNAL_NAME)
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.is_recording = False
+        self.pending = self.load_journal()
+        self.same_device = os.stat(self.spool_path).st_dev == os.stat(self.dataset_path).st_dev
+        if len(self.pending) > 0:
+            print("TakeMover: resuming {} takes".format(len(self.pending)))
+            self.changed.set()
+        controller.register_reader(self)
+        metrics.registry.gauge("recorder_mover_pending_takes", "takes waiting to move to the dataset root.",
+                               lambda: len(self.pending))
+
+    def load_journal(self):
+        try:
+            with open(self.journal_path) as f:
+                return json.load(f)["pending"]
+        except FileNotFoundError:
+            return []
+
+    def save_journal(self):
+        with open(self.journal_path + ".tmp", "w") as f:
+            json.dump({"pending": self.pending}, f, indent=2)
+        os.replace(self.journal_path + ".tmp", self.journal_path)
+
+    def enqueue(self, take_path):
+        # writer finalizer, register it after the finalizers that still read the take from the spool
+        with self.lock:
+            self.pending.append(os.path.relpath(take_path, self.spool_path))
+            self.save_journal()
+        self.changed.set()
+
+    def notify_record(self):
+        self.is_recording = True
+
+    def notify_save(self, aid, pid, sid):
+        self.is_recording = False
+        self.changed.set()
+
+    def notify_cancel(self):
+        self.is_recording = False
+        self.changed.set()
+
+    def is_busy(self):
+        return self.is_recording or self.writer.queue_depth() > 0
+
+    def wait_idle(self):
+        # returns False when the mover is stopped while waiting
+        while self.working and self.is_busy():
+            time.sleep(0.2)
+        return self.working
+
+    def proc(self):
+        while self.working:
+            self.changed.wait(timeout=1.0)
+            self.changed.clear()
+            while self.working and len(self.pending) > 0:
+                if not self.wait_idle():
+                    break
+                take = self.pending[0]
+                start = time.time()
+                try:
+                    moved_bytes = self.move_take(take)
+                except OSError as e:
+                    print("[ERROR] TakeMover: failed to move {}, retrying later: {}".format(take, e))
+                    self.changed.wait(timeout=10.0)
+                    continue
+                if moved_bytes is None:
+                    break
+                with self.lock:
+                    self.pending.remove(take)
+                    self.save_journal()
+                elapsed = max(time.time() - start, 1e-6)
+                print("TakeMover: {} moved to {}, {:.1f} MB in {:.1f}s ({:.1f} MB/s)".format(
+                    take, self.dataset_path, moved_bytes / 1e6, elapsed, moved_bytes / elapsed / 1e6))
+
+    def move_take(self, take):
+        # returns the number of bytes moved, None when the mover was stopped halfway
+        src = os.path.join(self.spool_path, take)
+        dst = os.path.join(self.dataset_path, take)
+        if not os.path.isdir(src):
+            return 0
+        if self.same_device and not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.rename(src, dst)
+            return 0
+
+        moved_bytes = 0
+        expected = load_take_checksums(src) or {}
+        for root, dirs, files in os.walk(src):
+            dst_root = os.path.join(dst, os.path.relpath(root, src))
+            os.makedirs(dst_root, exist_ok=True)
+            for name in files:
+                relpath = os.path.relpath(os.path.join(root, name), src).replace(os.sep, "/")
+                copied = self.copy_file(os.path.join(root, name), os.path.join(dst_root, name), expected.get(relpath))
+                if copied is None:
+                    return None
+                moved_bytes += copied
+        shutil.rmtree(src)
+        return moved_bytes
+
+    def copy_file(self, src, dst, expected=None):
+        size = os.path.getsize(src)
+        if os.path.exists(dst) and os.path.getsize(dst) == size:
+            return 0
+        part = dst + ".part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset > size:
+            offset = 0
+
+        # a resumed copy can't be checked without reading the part again
+        h = hashlib.sha256() if expected is not None and offset == 0 else None
+        with open(src, "rb") as fin, open(part, "r+b" if offset > 0 else "wb") as fout:
+            fin.seek(offset)
+            fout.seek(offset)
+            copied = 0
+            start, window = time.time(), 0
+            while True:
+                if self.is_busy():
+                    if not self.wait_idle():
+                        return None
+                    start, window = time.time(), 0
+                if not self.working:
+                    return None
+                chunk = fin.read(CHUNK_SIZE)
+                if len(chunk) == 0:
+                    break
+                fout.write(chunk)
+                if h is not None:
+                    h.update(chunk)
+                copied += len(chunk)
+                window += len(chunk)
+                if self.bandwidth > 0:
+                    ahead = window / self.bandwidth - (time.time() - start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            fout.flush()
+            os.fsync(fout.fileno())
+            # the spool copy is deleted after the move, keep it from pushing capture data out of the page cache
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fin.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        if h is not None and h.hexdigest() != expected:
+            os.remove(part)
+            raise OSError("{} does not match its checksum".format(src))
+        shutil.copystat(src, part)
+        os.replace(part, dst)
+        return copied
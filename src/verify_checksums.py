@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# checks the takes of a dataset against their checksums.sha256, files are hashed in a process pool.
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from dataset_manifest import find_takes
+from reader.checksums import CHECKSUM_NAME, hash_file, load_take_checksums
+
+
+def parse_args():
+    par = argparse.ArgumentParser("verify the checksums of the recorded takes")
+    par.add_argument("--path", default="./dataset", help="the dataset folder to verify.")
+    par.add_argument("-j", "--jobs", default=os.cpu_count(), type=int, help="number of files hashed in parallel.")
+    par.add_argument("--read-ahead", default=8, type=float,
+                     help="MB every worker asks the kernel to prefetch ahead of the file it is hashing.")
+    par.add_argument("--progress-interval", default=2.0, type=float, help="seconds between progress lines.")
+    return par.parse_args()
+
+
+def verify_file(task):
+    path, expected, read_ahead = task
+    try:
+        size = os.path.getsize(path)
+        actual = hash_file(path, read_ahead)
+    except FileNotFoundError:
+        return path, "missing", 0
+    except OSError as e:
+        return path, "error: {}".format(e), 0
+    return path, "ok" if actual == expected else "mismatch", size
+
+
+def collect(path, read_ahead):
+    # (hash tasks, problems found without hashing)
+    tasks, problems = [], []
+    for take_path in find_takes(path):
+        expected = load_take_checksums(take_path)
+        if expected is None:
+            problems.append((take_path, "no checksums"))
+            continue
+        for relpath, hex_digest in expected.items():
+            tasks.append((os.path.join(take_path, *relpath.split("/")), hex_digest, read_ahead))
+        for root, dirs, files in os.walk(take_path):
+            for name in files:
+                relpath = os.path.relpath(os.path.join(root, name), take_path).replace(os.sep, "/")
+                if relpath != CHECKSUM_NAME and relpath not in expected:
+                    problems.append((os.path.join(root, name), "not in checksums"))
+    return tasks, problems
+
+
+def main():
+    args = parse_args()
+    tasks, problems = collect(args.path, int(args.read_ahead * 1024 * 1024))
+    print("[info] {} files to verify".format(len(tasks)))
+
+    # biggest files first, so the pool doesn't end waiting on one large file
+    tasks.sort(key=lambda t: -os.path.getsize(t[0]) if os.path.exists(t[0]) else 0)
+    start = last_report = time.time()
+    done, done_bytes = 0, 0
+    with multiprocessing.Pool(max(1, args.jobs)) as pool:
+        for path, status, size in pool.imap_unordered(verify_file, tasks, chunksize=4):
+            done += 1
+            done_bytes += size
+            if status != "ok":
+                problems.append((path, status))
+            now = time.time()
+            if now - last_report >= args.progress_interval:
+                last_report = now
+                print("{}/{} files, {:.0f} MB, {:.0f} MB/s, {} problems".format(
+                    done, len(tasks), done_bytes / 1e6, done_bytes / 1e6 / (now - start), len(problems)))
+
+    elapsed = max(time.time() - start, 1e-6)
+    for path, status in problems:
+        print("{}: {}".format(path, status))
+    print("verified {} files, {:.0f} MB in {:.1f}s ({:.0f} MB/s), {} problems".format(
+        done, done_bytes / 1e6, elapsed, done_bytes / 1e6 / elapsed, len(problems)))
+    sys.exit(1 if len(problems) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,84 @@
+import json
 import os
 import queue
+import re
+import shutil
+import sqlite3
+import threading
 import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
+from dataset_manifest import DatasetManifest
+from reader import checksums, metrics
+from reader.profiling import profiler
 from reader.reader_callback import ReaderCallback
 from reader.runnable import Runnable
+from reader.utils import random_string
 from recorder_controller import RecorderController
+from take_journal import TakeJournal
+
+# takes are written under <path>/.partial/A####P####/S## and renamed into place once complete
+STAGING_NAME = ".partial"
+STAGED_PREFIXES = (".event_stream.", ".realsense_stream.", ".parts.")
+
+
+class TakeJob:
+    def __init__(self, take, take_id=None, key=None):
+        self.take = take
+        # journal id, unique across runs unlike the take, which restarts with the session
+        self.id = take_id or random_string(6)
+        self.key = key or take
+        self.parts = {}
+        self.descriptions = None
+        # json file of the descriptions, the journal only refers to it
+        self.parts_path = None
+        self.created = time.time()
+        self.ready = None
+        self.started = None
+        self.pending_modals = 0
+        # modals are written to `path`, the staging directory, which is renamed to `take_path` on commit
+        self.path = None
+        self.take_path = None
+        self.capture_metrics = {}
+        self.write_metrics = None
+        self.modal_seconds = {}
+
+    def is_complete(self, readables):
+        return len(readables) > 0 and all(r in self.parts for r in readables)
+
+    def is_on_disk(self):
+        return self.descriptions is not None and None not in self.descriptions.values()
+
+    def modals(self):
+        return [modal for parts in self.parts.values() for modal in parts]
 
 
 class WriteProcedure(Runnable, ReaderCallback):
     def __init__(self, args, controller: RecorderController):
         super(WriteProcedure, self).__init__(args)
-        self.pending_jobs = queue.Queue()
+        self.jobs = {}
+        # (state, job) for the spooler: "recorded" to journal a new take, "complete" once all its parts arrived
+        self.spool_queue = queue.Queue()
+        self.ready_jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.take_slots = threading.BoundedSemaphore(max(1, args.write_takes))
+        self.executor = None
+        self.spooler = None
+        self.journal = TakeJournal(args.path)
+        self.manifest = DatasetManifest(args.dataset_path, args.station)
+        if self.manifest.is_new:
+            print("writer: indexing the takes recorded before the manifest")
+            self.manifest.rebuild(*sorted({args.dataset_path, args.path}))
+        self.created = time.time()
         self.window = None
         self.readables = []
+        self.finalizers = []
+        self.write_bps = 0.0
+        self.record_metrics = None
         controller.register_reader(self)
+        metrics.registry.gauge("recorder_write_queue_depth", "takes waiting for or being written.", self.queue_depth)
+        metrics.registry.gauge("recorder_write_bytes_per_second", "recent write throughput.", lambda: self.write_bps)
 
     def register_window(self, w):
         self.window = w
@@ -21,41 +86,382 @@ class WriteProcedure(Runnable, ReaderCallback):
     def register_readable(self, r):
         print("writer: registering readable:", r)
         self.readables.append(r)
+        r.register_consumer(self)
 
-    def notify_save(self, aid, pid):
-        print("writer notified to saving")
-        self.pending_jobs.put((aid, pid))
+    def register_finalizer(self, f):
+        # f(take_path) is called once every modal of a take has been saved
+        self.finalizers.append(f)
 
-    def proc(self):
+    def get_job(self, take):
+        job = self.jobs.get(take)
+        if job is None:
+            job = self.jobs[take] = TakeJob(take)
+            # journaled by the spooler, this runs on the trigger thread of the stop and must not wait for a sync
+            self.spool_queue.put(("recorded", job))
+        return job
+
+    def notify_record(self):
+        if metrics.registry.enabled:
+            self.record_metrics = metrics.stage_snapshot()
+
+    def notify_save(self, aid, pid, sid):
+        print("writer notified to saving", (aid, pid, sid))
+        with self.lock:
+            job = self.get_job((aid, pid, sid))
+            if self.record_metrics is not None:
+                # capture side stages of the take, only one take is recorded at a time
+                job.capture_metrics = metrics.stage_summary(self.record_metrics)
+                self.record_metrics = None
+        self.update_queue_size()
+
+    def notify_cancel(self):
+        self.record_metrics = None
+
+    def notify_parts(self, readable, take, parts):
+        print("writer: {} modals of take {} arrived from {}".format(len(parts), take, readable))
+        with self.lock:
+            job = self.get_job(take)
+            if readable in job.parts:
+                print("[WARN] writer: {} delivered take {} twice, keeping the latest".format(readable, take))
+            job.parts[readable] = parts
+            if not job.is_complete(self.readables):
+                return
+        self.spool_queue.put(("complete", job))
 
+    def queue_depth(self):
+        with self.lock:
+            return len(self.jobs)
+
+    def report_status(self):
+        return {"queue_depth": self.queue_depth(), "write_bps": self.write_bps}
+
+    def update_queue_size(self):
+        if self.window:
+            self.window.signal_queue_size.emit(self.queue_depth())
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=max(1, self.args.write_workers),
+                                               thread_name_prefix="writer")
+        super(WriteProcedure, self).start()
+        if self.spooler is None:
+            self.spooler = threading.Thread(target=self.spool_proc, name="WriteSpooler")
+            self.spooler.start()
+
+    def stop(self):
+        with self.lock:
+            pending = list(self.jobs.values())
+        if len(pending) > 0:
+            on_disk = sum(1 for job in pending if job.is_on_disk())
+            print("[WARN] writer: stopping with {} takes pending, {} of them are on disk and are written on the next "
+                  "start, the others are lost".format(len(pending), on_disk))
+        super(WriteProcedure, self).stop()
+        if self.spooler is not None:
+            self.spooler.join()
+            self.spooler = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.journal.close()
+        self.manifest.close()
+
+    def spool_proc(self):
+        # journals new takes and where the parts of each complete take are on disk, before the take waits for a
+        # write slot
         while self.working:
+            try:
+                state, job = self.spool_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if state == "recorded":
+                self.journal.append(job.id, job.take, "recorded")
+                continue
+            self.spool_job(job)
+            job.ready = time.time()
+            self.ready_jobs.put(job)
+
+    def spool_job(self, job):
+        job.descriptions = {}
+        for readable, parts in job.parts.items():
+            try:
+                job.descriptions[type(readable).__name__] = readable.describe_parts(parts)
+            except Exception:
+                print("[ERROR] writer: {} failed to describe take {}".format(readable, job.take))
+                traceback.print_exc()
+                job.descriptions[type(readable).__name__] = None
+        # descriptions carry the frame metadata and the event timeline of the take, they are kept out of the
+        # journal so it stays small
+        job.parts_path = os.path.join(self.args.path, ".parts.{}.json".format(job.id))
+        with open(job.parts_path + ".tmp", "w") as f:
+            json.dump(job.descriptions, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(job.parts_path + ".tmp", job.parts_path)
+        self.journal.append(job.id, job.take, "spooled", parts=job.parts_path)
+
+    def load_descriptions(self, record):
+        if record.get("parts") is None:
+            return {}
+        with open(record["parts"]) as f:
+            return json.load(f)
 
-            if len(self.readables) <= 0 or not all([r.poll() for r in self.readables]):
-                time.sleep(0.1)
+    def remove_descriptions(self, parts_path):
+        if parts_path is None:
+            return
+        try:
+            os.remove(parts_path)
+        except FileNotFoundError:
+            pass
+
+    def recover(self):
+        # startup pass over the journal of the previous run, call it once every readable is registered.
+        # takes whose parts were all on disk are written again, resuming into their staging directory, takes
+        # that were renamed but not finalized get their finalizers. the rest are lost, their leftovers and staged
+        # recordings nobody refers to are removed.
+        readables = {type(r).__name__: r for r in self.readables}
+        resumed = []
+        # only takes of the previous run, the controller and the readers may have journaled takes since
+        for record in self.journal.previous.values():
+            take, state = tuple(record["take"]), record["state"]
+            if state == "committed":
+                continue
+            if state == "writing" and not os.path.isdir(record["staging"]) and os.path.isdir(record["path"]):
+                print("writer: finalizing take {} at {}".format(take, record["path"]))
+                self.add_to_manifest(record["path"])
+                self.run_finalizers(record["path"])
+                self.journal.append(record["id"], take, "committed", path=record["path"])
+                self.remove_descriptions(record.get("parts"))
                 continue
 
-            print("writer: exit from poll loop")
-            multi_modal_stream = []
-            for r in self.readables:
-                print("writer: reading from:", r, "...")
-                multi_modal_stream.extend(r.read())
+            job = TakeJob(take, record["id"], ("recovered", record["id"]))
+            try:
+                descriptions = self.load_descriptions(record)
+                if state == "recorded" or None in descriptions.values() or not set(descriptions) <= set(readables):
+                    raise ValueError("only {} of its parts are on disk".format(
+                        [name for name, d in descriptions.items() if d is not None]))
+                for name, description in descriptions.items():
+                    job.parts[readables[name]] = readables[name].restore_parts(description)
+            except Exception as e:
+                print("[WARN] writer: take {} of the previous run is lost: {}".format(take, e))
+                continue
+            if not job.is_complete(self.readables):
+                print("[WARN] writer: take {} of the previous run is lost: no parts from {}".format(
+                    take, [r for r in self.readables if r not in job.parts]))
+                continue
+            job.descriptions = descriptions
+            job.parts_path = record["parts"]
+            if state == "writing":
+                job.path, job.take_path = record["staging"], record["path"]
+            resumed.append((job, record))
+
+        self.journal.compact([record for job, record in resumed])
+        self.remove_orphans([job for job, record in resumed])
+        for job, record in resumed:
+            print("writer: resuming take {} of the previous run".format(job.take))
+            with self.lock:
+                self.jobs[job.key] = job
+            job.ready = time.time()
+            self.ready_jobs.put(job)
+        self.update_queue_size()
+
+    def remove_orphans(self, resumed):
+        # staged recordings and half written takes of the previous run that no resumed take refers to. entries
+        # changed since this writer was created belong to the current run
+        keep = {job.path for job in resumed if job.path is not None} | {job.parts_path for job in resumed}
+        for job in resumed:
+            for description in job.descriptions.values():
+                if isinstance(description, dict):
+                    keep.update(v for v in description.values() if isinstance(v, str))
+
+        staging_root = os.path.join(self.args.path, STAGING_NAME)
+        candidates = [os.path.join(self.args.path, name) for name in os.listdir(self.args.path)
+                      if name.startswith(STAGED_PREFIXES)]
+        if os.path.isdir(staging_root):
+            for person_name in os.listdir(staging_root):
+                person_path = os.path.join(staging_root, person_name)
+                candidates += [os.path.join(person_path, name) for name in os.listdir(person_path)]
+        for path in candidates:
+            if path in keep or os.path.getmtime(path) >= self.created:
+                continue
+            print("writer: removing", path)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        if os.path.isdir(staging_root):
+            for person_name in os.listdir(staging_root):
+                try:
+                    os.rmdir(os.path.join(staging_root, person_name))
+                except OSError:
+                    pass
 
-            aid, pid = self.pending_jobs.get()
-            print("Writer: start saving:", aid, pid)
-            path_write = os.path.join(self.args.path, "A{:04d}P{:04d}".format(aid, pid))
-            os.makedirs(path_write, exist_ok=True)
+    def allocate_path(self, job):
+        # returns (staging path, take path). the next take number comes from the manifest and the takes being
+        # written, a take on disk the manifest doesn't know about is skipped
+        aid, pid, sid = job.take
+        person_name = "A{:04d}P{:04d}".format(aid, pid)
+        numbers = [-1] + self.manifest.take_numbers(aid, pid)
+        staged_path = os.path.join(self.args.path, STAGING_NAME, person_name)
+        if os.path.isdir(staged_path):
+            numbers += [int(name[1:]) for name in os.listdir(staged_path) if re.fullmatch(r"S\d+", name)]
+        number = max(numbers) + 1
+        while any(os.path.exists(os.path.join(root, person_name, "S{:02d}".format(number)))
+                  for root in (self.args.path, self.args.dataset_path)):
+            number += 1
+        take_name = "S{:02d}".format(number)
+        staging_path = os.path.join(self.args.path, STAGING_NAME, person_name, take_name)
+        with self.lock:
+            os.makedirs(staging_path)
+        return staging_path, os.path.join(self.args.path, person_name, take_name)
 
-            root_path, sub_dirs, sub_files = next(os.walk(path_write))
-            path_write = os.path.join(path_write, "S{:02d}".format(len(sub_dirs)))
+    def commit(self, job):
+        # the take directory appears complete or not at all
+        os.makedirs(os.path.dirname(job.take_path), exist_ok=True)
+        os.rename(job.path, job.take_path)
+        checksums.registry.move(job.path, job.take_path)
+        with self.lock:
+            try:
+                os.rmdir(os.path.dirname(job.path))
+            except OSError:
+                pass
+        job.path = job.take_path
+        self.add_to_manifest(job.path)
 
-            print("number of modals:", len(multi_modal_stream))
+    def add_to_manifest(self, take_path):
+        try:
+            self.manifest.add_take(take_path)
+        except (OSError, sqlite3.Error):
+            print("[ERROR] writer: failed to add {} to the manifest".format(take_path))
+            traceback.print_exc()
 
-            for each in multi_modal_stream:
-                modal_name, f_save, modal_data = each
-                modal_path = os.path.join(path_write, modal_name)
-                os.makedirs(modal_path, exist_ok=True)
-                print("calling save function:", modal_path)
+    def run_finalizers(self, take_path):
+        for f in self.finalizers:
+            try:
+                f(take_path)
+            except Exception:
+                print("[ERROR] writer: finalizer failed on", take_path)
+                traceback.print_exc()
+
+    def write_modal(self, job, modal):
+        modal_name, f_save, modal_data = modal
+        modal_path = os.path.join(job.path, modal_name)
+        write_start = time.perf_counter()
+        try:
+            os.makedirs(modal_path, exist_ok=True)
+            print("calling save function:", modal_path)
+            with profiler.task():
                 f_save(modal_path, modal_data)
+        except Exception:
+            print("[ERROR] writer: failed to save", modal_path)
+            traceback.print_exc()
+            metrics.count(metrics.modal_errors_total)
+        finally:
+            seconds = time.perf_counter() - write_start
+            metrics.observe("write", seconds)
+            with self.lock:
+                job.modal_seconds[modal_name] = job.modal_seconds.get(modal_name, 0.0) + seconds
+                job.pending_modals -= 1
+                finished = job.pending_modals == 0
+            if finished:
+                self.finish_job(job)
+
+    def write_take_metrics(self, job):
+        # per take summary next to the frame reports, the write side stages of takes written at the same time
+        # overlap
+        now = time.time()
+        summary = {
+            "take": list(job.take),
+            "capture": job.capture_metrics,
+            "write": {
+                "parts_seconds": job.ready - job.created,
+                "queue_wait_seconds": job.started - job.ready,
+                "write_seconds": now - job.started,
+                "modal_seconds": job.modal_seconds,
+                "stages": metrics.stage_summary(job.write_metrics),
+            },
+        }
+        modal_path = os.path.join(job.path, "frame_index")
+        os.makedirs(modal_path, exist_ok=True)
+        with open(os.path.join(modal_path, "metrics.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+
+    def finish_job(self, job):
+        if job.path is not None and self.args.take_metrics and metrics.registry.enabled:
+            try:
+                self.write_take_metrics(job)
+            except OSError:
+                print("[ERROR] writer: failed to write metrics of", job.path)
+                traceback.print_exc()
+
+        if job.path is not None:
+            try:
+                profiler.finish(job.take, job.path)
+            except OSError:
+                print("[ERROR] writer: failed to write the profile of", job.path)
+                traceback.print_exc()
+            try:
+                self.commit(job)
+            except OSError:
+                # left in staging and journaled as writing, the next start finishes it
+                print("[ERROR] writer: failed to commit", job.path)
+                traceback.print_exc()
+            else:
+                self.run_finalizers(job.path)
+                self.journal.append(job.id, job.take, "committed", path=job.path)
+                self.remove_descriptions(job.parts_path)
+        else:
+            self.journal.append(job.id, job.take, "committed")
+            self.remove_descriptions(job.parts_path)
+
+        now = time.time()
+        if job.path is not None:
+            take_bytes = sum(os.path.getsize(os.path.join(root, name))
+                             for root, dirs, files in os.walk(job.path) for name in files)
+            take_bps = take_bytes / max(now - job.started, 1e-6)
+            metrics.count(metrics.written_bytes_total, take_bytes)
+            metrics.count(metrics.takes_total)
+            self.write_bps = take_bps if self.write_bps == 0 else 0.8 * self.write_bps + 0.2 * take_bps
+
+        if job.path is not None:
+            # digests of a take that failed to commit or to finalize
+            checksums.registry.discard(job.path)
+        with self.lock:
+            self.jobs.pop(job.key, None)
+            depth = len(self.jobs)
+        self.take_slots.release()
+        print("writer: take {} saved to {}, parts {:.2f}s, queued {:.2f}s, write {:.2f}s, total {:.2f}s, "
+              "queue depth {}".format(job.take, job.path, job.ready - job.created, job.started - job.ready,
+                                      now - job.started, now - job.created, depth))
+        self.update_queue_size()
+
+    def proc(self):
+
+        while self.working:
+            profiler.checkpoint()
+            try:
+                job = self.ready_jobs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            while self.working and not self.take_slots.acquire(timeout=0.1):
+                pass
+            if not self.working:
+                break
+
+            job.started = time.time()
+            metrics.observe("queue_wait", job.started - job.ready)
+            if metrics.registry.enabled:
+                job.write_metrics = metrics.stage_snapshot()
+            modals = job.modals()
+            print("Writer: start saving:", job.take, "number of modals:", len(modals))
+            if len(modals) == 0:
+                self.finish_job(job)
+                continue
+
+            if job.path is None:
+                job.path, job.take_path = self.allocate_path(job)
+                self.journal.append(job.id, job.take, "writing", staging=job.path, path=job.take_path)
+            job.pending_modals = len(modals)
 
-            if self.window:
-                self.window.signal_queue_size.emit(self.pending_jobs.qsize())
+            for modal in modals:
+                self.executor.submit(self.write_modal, job, modal)
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+from reader.cross_index import build_cross_index, load_cross_index, read_event_slice, write_event_timeline
+from reader.frame_index import write_frame_index
+
+
+def make_take(tmp_path, frame_times, samples, event_bytes=4096):
+    index_path = tmp_path / "frame_index"
+    event_path = tmp_path / "event"
+    index_path.mkdir()
+    event_path.mkdir()
+    rows = [(i, i, t * 1000, t * 1000, 0, t) for i, t in enumerate(frame_times)]
+    write_frame_index(str(index_path / "realsense.cfi"), rows, list(range(len(rows))))
+    write_event_timeline(str(index_path), samples, {"record": samples[0][0]})
+    (event_path / "A0001_P0001_S00.bin").write_bytes(bytes(range(256)) * (event_bytes // 256))
+    return str(tmp_path)
+
+
+def test_single_frame_take(tmp_path):
+    take_path = make_take(tmp_path, [10.0], [(9.99, 0), (10.005, 1024), (10.03, 2048), (10.5, 4096)])
+
+    cross_index = build_cross_index(take_path)
+
+    assert cross_index.shape == (1, 2)
+    start, end = cross_index[0]
+    assert start == 0
+    assert end > start
+    assert len(read_event_slice(take_path, 0)) == end - start
+
+
+def test_empty_take(tmp_path):
+    take_path = make_take(tmp_path, [], [(9.99, 0), (10.5, 4096)])
+
+    cross_index = build_cross_index(take_path)
+
+    assert cross_index.shape == (0, 2)
+    assert load_cross_index(take_path).shape == (0, 2)
+    assert os.path.exists(os.path.join(take_path, "frame_index", "color_event_index.npy"))
+
+
+def test_last_frame_ends_after_it_starts(tmp_path):
+    frame_times = list(np.arange(3) / 60 + 10.0)
+    take_path = make_take(tmp_path, frame_times, [(9.99 + i * 0.01, i * 256) for i in range(16)])
+
+    cross_index = build_cross_index(take_path)
+
+    assert (cross_index[:, 1] >= cross_index[:, 0]).all()
+    assert cross_index[-1, 1] > cross_index[-1, 0]
@@ -0,0 +1,49 @@
+import socket
+import types
+
+import netsync
+
+
+def make_client(loss=0.0):
+    args = types.SimpleNamespace(port=0, loss=loss, clock_interval=1.0, status_interval=1.0)
+    return netsync.SyncClient(args)
+
+
+def command(ctrl, seq, session=7):
+    return netsync.pack_message(netsync.KIND_COMMAND, ctrl, session, seq, 0.0, 1, 2, 3)
+
+
+def test_record_retransmitted_after_its_stop_is_not_dispatched():
+    client = make_client()
+    address = ("127.0.0.1", client.conn.getsockname()[1])
+    try:
+        # the first record datagram is lost
+        client.loss = 1.0
+        assert client.handle_datagram(command(netsync.CTRL_RECORD, 1), address, 0.0) is None
+        client.loss = 0.0
+
+        stop = client.handle_datagram(command(netsync.CTRL_STOP, 2), address, 0.0)
+        assert stop["ctrl"] == "stop"
+
+        # the retransmitted record arrives after the stop, it is acked but never dispatched
+        assert client.handle_datagram(command(netsync.CTRL_RECORD, 1), address, 0.0) is None
+        ack = netsync.unpack_message(client.conn.recvfrom(1024)[0])
+        while ack["seq"] != 1:
+            ack = netsync.unpack_message(client.conn.recvfrom(1024)[0])
+        assert ack["kind"] == netsync.KIND_ACK
+        assert client.stale == 1
+    finally:
+        client.close()
+
+
+def test_duplicates_are_dropped_and_new_sessions_start_over():
+    client = make_client()
+    address = ("127.0.0.1", client.conn.getsockname()[1])
+    try:
+        assert client.handle_datagram(command(netsync.CTRL_RECORD, 1), address, 0.0) is not None
+        assert client.handle_datagram(command(netsync.CTRL_RECORD, 1), address, 0.0) is None
+        assert client.duplicates == 1
+        # a restarted server numbers its commands from 1 again
+        assert client.handle_datagram(command(netsync.CTRL_RECORD, 1, session=8), address, 0.0) is not None
+    finally:
+        client.close()